@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Per-album item count, total bytes and newest-item time.
+
+Stats are computed once by a background walk and saved next to the albums
+in `STATS_FILE`. After that they are kept current from moves, removals and
+transcodes instead of walking again. The mtime of every directory walked
+is recorded, and an album is only re-walked when one of them no longer
+matches, i.e. something outside ImgSack changed it.
+
+The record_* methods take the album directory's mtime from just before
+ImgSack's own change. Only when that still matches the saved one is the
+saved mtime moved past the change; otherwise something else touched the
+directory too, and the album is walked again on the next refresh.
+"""
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from d4mnLogger import logger
+
+STATS_FILE = ".imgsack-stats.json"
+SAVE_INTERVAL = 5.0  # seconds between saves of incremental updates
+
+
+def walk_album(album: Path) -> dict:
+    count, total, newest = 0, 0, 0.0
+    dirs = {}
+    pending = [album]
+    while pending:
+        directory = pending.pop()
+        # Taken before the scan, so a change during it shows up next time
+        dirs[os.path.relpath(directory, album)] = os.stat(directory).st_mtime_ns
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    st = entry.stat(follow_symlinks=False)
+                    count += 1
+                    total += st.st_size
+                    newest = max(newest, st.st_mtime)
+    return {"count": count, "bytes": total, "newest": newest, "dirs": dirs}
+
+
+class AlbumStats:
+    """
+    `on_change` is called (from whichever thread made the change) with the
+    album name whenever that album's stats change.
+    """
+
+    def __init__(self, album_directory: Path, albums: list, on_change=None):
+        self.album_directory = album_directory
+        self.albums = [a for a in albums if (album_directory / a).is_dir()]
+        self.on_change = on_change
+        self.stats_file = album_directory / STATS_FILE
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._last_save = 0.0
+        self._dirty = False
+        self.load()
+        threading.Thread(target=self.refresh, name="albumstats", daemon=True).start()
+
+    def load(self) -> None:
+        try:
+            saved = json.loads(self.stats_file.read_text())
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring album stats in {self.stats_file}: {e}")
+            return
+        with self._lock:
+            self._stats = {a: s for a, s in saved.items() if a in self.albums}
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            data = json.dumps(self._stats)
+            self._dirty = False
+            self._last_save = time.monotonic()
+        temp = self.stats_file.with_name(f"{STATS_FILE}.{os.getpid()}.tmp")
+        try:
+            temp.write_text(data)
+            os.replace(temp, self.stats_file)
+        except OSError as e:
+            logger.warning(f"Could not save album stats to {self.stats_file}: {e}")
+
+    def get(self, album: str):
+        with self._lock:
+            stats = self._stats.get(album)
+            if stats is None:
+                return None
+            return {k: v for k, v in stats.items() if k != "dirs"}
+
+    def _dir_mtime(self, album: str) -> int:
+        return (self.album_directory / album).stat().st_mtime_ns
+
+    def _unchanged(self, album: str, dirs) -> bool:
+        if not dirs:
+            return False
+        base = self.album_directory / album
+        for relative, mtime in dirs.items():
+            try:
+                if (base / relative).stat().st_mtime_ns != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def refresh(self) -> None:
+        """
+        Walk every album with a directory that changed since the stats were saved.
+        """
+        walked = 0
+        for album in self.albums:
+            with self._lock:
+                known = self._stats.get(album)
+            if known is not None and self._unchanged(album, known.get("dirs")):
+                continue
+            try:
+                stats = walk_album(self.album_directory / album)
+            except OSError as e:
+                logger.warning(f"Could not walk album {album}: {e}")
+                continue
+            with self._lock:
+                self._stats[album] = stats
+                self._dirty = True
+            walked += 1
+            self._changed(album)
+        logger.info(f"Album stats: walked {walked} of {len(self.albums)} albums")
+        self.save()
+
+    def _album_of(self, item: Path):
+        album = item.parent
+        if album.parent == self.album_directory and album.name in self.albums:
+            return album.name
+        return None
+
+    def _update(
+        self,
+        item: Path,
+        count: int,
+        size: int,
+        mtime: float = 0.0,
+        dir_mtime: int = None,
+    ) -> None:
+        album = self._album_of(item)
+        if album is None:
+            return
+        with self._lock:
+            stats = self._stats.get(album)
+            if stats is None:
+                # Still waiting for the first walk, which will include this item
+                return
+            stats["count"] = max(0, stats["count"] + count)
+            stats["bytes"] = max(0, stats["bytes"] + size)
+            stats["newest"] = max(stats["newest"], mtime)
+            dirs = stats.get("dirs")
+            if dir_mtime is not None and dirs and dirs.get(".") == dir_mtime:
+                try:
+                    dirs["."] = self._dir_mtime(album)
+                except OSError:
+                    stats.pop("dirs")
+            else:
+                stats.pop("dirs", None)
+            self._dirty = True
+            due = time.monotonic() - self._last_save > SAVE_INTERVAL
+        self._changed(album)
+        if due:
+            self.save()
+
+    def record_add(self, item: Path, dir_mtime: int = None) -> None:
+        st = item.stat()
+        self._update(item, 1, st.st_size, st.st_mtime, dir_mtime)
+
+    def record_remove(self, item: Path, size: int, dir_mtime: int = None) -> None:
+        self._update(item, -1, -size, dir_mtime=dir_mtime)
+
+    def record_resize(self, item: Path, delta: int, dir_mtime: int = None) -> None:
+        self._update(item, 0, delta, dir_mtime=dir_mtime)
+
+    def _changed(self, album: str) -> None:
+        if self.on_change is not None:
+            self.on_change(album)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Burst and sequence grouping.
+
+Consecutive queue items are grouped when their capture times are close and
+their tiny downsampled thumbnails look alike, so a whole camera burst can be
+shown as one stacked item and filed with a single key press.
+"""
+
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from d4mnLogger import logger
+from profiler import span
+
+DEFAULT_GROUP_GAP = 2.0  # seconds between consecutive frames
+DEFAULT_GROUP_DISTANCE = 12  # mean absolute grey level difference, 0 - 255
+SIGNATURE_SIZE = 8
+SIGNATURE_BATCH = 64
+EXIF_READ_BYTES = 128 * 1024
+
+_TAG_EXIF_IFD = 0x8769
+_TAG_DATETIME_ORIGINAL = 0x9003
+_TAG_SUBSEC_ORIGINAL = 0x9291
+
+
+def _ifd_entries(tiff: bytes, offset: int, endian: str):
+    count = struct.unpack_from(f"{endian}H", tiff, offset)[0]
+    for i in range(count):
+        entry = offset + 2 + i * 12
+        tag, kind, n = struct.unpack_from(f"{endian}HHI", tiff, entry)
+        yield tag, kind, n, entry + 8
+
+
+def _ascii_value(tiff: bytes, n: int, value_offset: int, endian: str) -> str:
+    if n > 4:
+        value_offset = struct.unpack_from(f"{endian}I", tiff, value_offset)[0]
+    return tiff[value_offset : value_offset + n].split(b"\0")[0].decode("ascii")
+
+
+def exif_capture_time(p: Path):
+    """
+    DateTimeOriginal (plus SubSecTimeOriginal) of a JPEG as a timestamp, or None.
+
+    Only the first `EXIF_READ_BYTES` of the file are read.
+    """
+    with open(p, "rb") as f:
+        data = f.read(EXIF_READ_BYTES)
+    if data[:2] != b"\xff\xd8":
+        return None
+    pos = 2
+    try:
+        while pos + 4 <= len(data) and data[pos] == 0xFF:
+            marker = data[pos + 1]
+            length = struct.unpack_from(">H", data, pos + 2)[0]
+            if marker == 0xE1 and data[pos + 4 : pos + 10] == b"Exif\0\0":
+                tiff = data[pos + 10 : pos + 2 + length]
+                endian = "<" if tiff[:2] == b"II" else ">"
+                ifd0 = struct.unpack_from(f"{endian}I", tiff, 4)[0]
+                for tag, _kind, _n, value in _ifd_entries(tiff, ifd0, endian):
+                    if tag == _TAG_EXIF_IFD:
+                        exif_ifd = struct.unpack_from(f"{endian}I", tiff, value)[0]
+                        break
+                else:
+                    return None
+                stamp, subsec = None, ""
+                for tag, _kind, n, value in _ifd_entries(tiff, exif_ifd, endian):
+                    if tag == _TAG_DATETIME_ORIGINAL:
+                        stamp = _ascii_value(tiff, n, value, endian)
+                    elif tag == _TAG_SUBSEC_ORIGINAL:
+                        subsec = _ascii_value(tiff, n, value, endian).strip()
+                if stamp is None:
+                    return None
+                seconds = datetime.strptime(stamp, "%Y:%m:%d %H:%M:%S").timestamp()
+                if subsec.isdigit():
+                    seconds += int(subsec) / 10 ** len(subsec)
+                return seconds
+            if marker == 0xDA:  # start of scan, no more metadata
+                return None
+            pos += 2 + length
+    except (struct.error, ValueError, UnicodeDecodeError):
+        return None
+    return None
+
+
+def capture_time(p: Path):
+    """
+    EXIF capture time or mtime, or None if the file is gone (the operator
+    may file or trash items while grouping runs).
+    """
+    if p.suffix.lower() in (".jpg", ".jpeg"):
+        try:
+            stamp = exif_capture_time(p)
+            if stamp is not None:
+                return stamp
+        except OSError:
+            pass
+    try:
+        return os.stat(p).st_mtime
+    except OSError:
+        return None
+
+
+def image_signature(p: Path):
+    """
+    An 8x8 greyscale thumbnail as 64 bytes, or None if the image cannot be read.
+    """
+    from PySide6.QtCore import QSize
+    from PySide6.QtGui import QImage, QImageReader
+
+    reader = QImageReader(str(p))
+    reader.setAutoTransform(True)
+    # Asking the decoder for a small size lets JPEG skip most of the work
+    reader.setScaledSize(QSize(SIGNATURE_SIZE * 8, SIGNATURE_SIZE * 8))
+    with span("decode", what="signature"):
+        image = reader.read()
+    if image.isNull():
+        return None
+    image = image.convertToFormat(QImage.Format_Grayscale8).scaled(
+        SIGNATURE_SIZE, SIGNATURE_SIZE
+    )
+    row = image.bytesPerLine()
+    raw = bytes(image.constBits())
+    return b"".join(
+        raw[y * row : y * row + SIGNATURE_SIZE] for y in range(SIGNATURE_SIZE)
+    )
+
+
+def signature_distance(a: bytes, b: bytes) -> float:
+    return sum(abs(x - y) for x, y in zip(a, b)) / len(a)
+
+
+def image_signatures(items: list, workers: int = None) -> list:
+    """
+    Signatures for `items`, computed in batches on a thread pool.
+    """
+    signatures = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(items), SIGNATURE_BATCH):
+            batch = items[start : start + SIGNATURE_BATCH]
+            signatures.extend(pool.map(image_signature, batch))
+    return signatures
+
+
+def group_items(
+    items: list,
+    max_gap: float = DEFAULT_GROUP_GAP,
+    max_distance: float = DEFAULT_GROUP_DISTANCE,
+) -> list:
+    """
+    Split `items` (in queue order) into runs of near-identical frames.
+
+    Returns a list of lists covering every item exactly once. Signatures are
+    only computed for items that have a neighbour within `max_gap` seconds,
+    so a queue without bursts costs one stat (or EXIF read) per item.
+    """
+    if not items:
+        return []
+    with span("group", items=len(items)):
+        return _group_items(items, max_gap, max_distance)
+
+
+def _group_items(items: list, max_gap: float, max_distance: float) -> list:
+    times = [capture_time(p) for p in items]
+    close = [
+        a is not None and b is not None and abs(b - a) <= max_gap
+        for a, b in zip(times, times[1:])
+    ]
+    candidates = sorted({j for i, c in enumerate(close) if c for j in (i, i + 1)})
+    signatures = dict(zip(candidates, image_signatures([items[i] for i in candidates])))
+
+    groups = [[items[0]]]
+    for i in range(1, len(items)):
+        a, b = signatures.get(i - 1), signatures.get(i)
+        if (
+            close[i - 1]
+            and a is not None
+            and b is not None
+            and signature_distance(a, b) <= max_distance
+        ):
+            groups[-1].append(items[i])
+        else:
+            groups.append([items[i]])
+    bursts = sum(1 for g in groups if len(g) > 1)
+    logger.info(f"Grouped {len(items)} items into {len(groups)} ({bursts} bursts)")
+    return groups
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Constants and file operations shared by the Qt window (qtims.py) and the
+sorting daemon (imsd.py). Must not import Qt.
+"""
+
+PROGRAM_NAME = "ImageSack"
+PROGRAM_VERSION = "0.0.1rNone"
+PYTHON_VERSION = "3.9"
+VERSION_INFO = f"{PROGRAM_NAME} v{PROGRAM_VERSION} -  Python {PYTHON_VERSION}"
+
+import os
+from pathlib import Path
+
+from d4mnLogger import logger
+from profiler import span
+
+DEFAULT_EXTENSIONS = [
+    ".jpg",
+    ".jpeg",
+    ".png",
+    ".gif",
+    ".bmp",
+    ".tif",
+    ".tiff",
+    ".webp",
+    ".svg",
+]
+MIN_ALBUMS = 9
+MAX_ALBUMS = 36  # no mod, shift, alt, ctrl * 9 (on the numeric keypad)
+
+
+def image_extensions(extensions) -> set:
+    """
+    Lower-case, dotted suffixes from a list such as [".jpg", "PNG"], or from
+    an older "jpg, png" style string.
+    """
+    if isinstance(extensions, str):
+        extensions = extensions.replace(",", " ").split()
+    return {f".{e.lower().lstrip('.')}" for e in extensions if e.strip(".")}
+
+
+def is_album(p: Path) -> bool:
+    return os.path.isdir(p.expanduser())
+
+
+def is_not_dotted(p: Path) -> bool:
+    return p.name[0] != "."
+
+
+def format_bytes(size: int) -> str:
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def unique_path(p: Path) -> Path:
+    """
+    `p`, or the first free "name.2.ext", "name.3.ext", ... next to it.
+    """
+    counter = 1
+    candidate = p
+    while candidate.exists() or candidate.is_symlink():
+        counter += 1
+        candidate = p.with_name(f"{p.stem}.{counter}{p.suffix}")
+    return candidate
+
+
+def move_item(
+    source_file: Path, destination_folder: Path, transcoder=None, stats=None
+) -> Path:
+    """
+    Move `source_file` into `destination_folder`, never replacing a file
+    already there: a clash gets a numbered name. Returns the new path.
+    """
+    logger.info(f"Moving {source_file} to {destination_folder}")
+    destination = unique_path(destination_folder / source_file.name)
+    dir_mtime = destination_folder.stat().st_mtime_ns if stats is not None else None
+    with span("move", item=source_file.name):
+        source_file.rename(destination)
+    if stats is not None:
+        stats.record_add(destination, dir_mtime)
+    if transcoder is not None:
+        transcoder.submit(destination)
+    return destination
+
+
+def move_items(
+    source_files: list, destination_folder: Path, transcoder=None, stats=None
+) -> tuple:
+    """
+    Move a batch of items into one album. Returns a dict of moved items to
+    their new paths, and the list of items that could not be moved.
+    """
+    logger.info(f"Moving {len(source_files)} item(s) to {destination_folder}")
+    moved = {}
+    failed = []
+    for source_file in source_files:
+        try:
+            moved[source_file] = move_item(
+                source_file, destination_folder, transcoder, stats
+            )
+        except OSError as e:
+            logger.error(f"Could not move {source_file}: {e}")
+            failed.append(source_file)
+    return moved, failed
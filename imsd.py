@@ -0,0 +1,639 @@
+#!/usr/bin/env python3
+"""
+ImgSack sorting daemon.
+
+Keeps the source queue, album list, thumbnail cache and move journal in one
+long-lived process so that GUI restarts and multiple clients share the same
+warm state. Clients talk to it over a small local HTTP/JSON API:
+
+    GET  /status                          directories and queue length
+    GET  /albums                          album names
+    GET  /queue?offset=0&limit=100        paginated queue listing
+    GET  /thumbnail?item=NAME&size=256    PNG thumbnail (ETag / Cache-Control)
+    POST /move   {"moves": [{"item": NAME, "album": NAME}, ...]}
+    POST /undo   {"count": 1}
+    POST /trash  {"items": [NAME, ...]}
+    POST /rescan
+
+There is no authentication, so the API only answers requests addressed to
+a loopback name or the --host it listens on, refuses requests from a web
+page on any other origin and only takes JSON POST bodies: a browser cannot
+send those across origins without a preflight the daemon never answers.
+"""
+
+import argparse
+import json
+import threading
+import time
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlencode, urlparse
+from urllib.request import Request, urlopen
+
+from PySide6.QtCore import QSize, Qt
+from PySide6.QtGui import QImage, QImageReader
+
+import profiler
+from albumstats import AlbumStats
+from d4mnLogger import logger
+from imscore import (
+    DEFAULT_EXTENSIONS,
+    MAX_ALBUMS,
+    VERSION_INFO,
+    image_extensions,
+    is_album,
+    is_not_dotted,
+    move_item,
+)
+from memory import DEFAULT_MEMORY_BUDGET, MemoryGovernor, parse_size
+from profiler import span
+from thumbcache import (
+    THUMBNAIL_CACHE_MAX_BYTES,
+    ThumbnailStore,
+    encode_thumbnail,
+    tier_for,
+)
+from transcode import TranscodePipeline, settings_from_config
+from trash import Trash
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8734
+LOOPBACK_HOSTS = {"localhost", "127.0.0.1", "::1"}
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+DEFAULT_THUMBNAIL_SIZE = 256
+MAX_UNDO = 100
+CLIENT_TIMEOUT = 10  # seconds; a stuck daemon must not hang the GUI forever
+
+
+def render_thumbnail(source_file: Path, size: int) -> QImage:
+    reader = QImageReader(str(source_file))
+    reader.setAutoTransform(True)
+    original = reader.size()
+    if original.isValid() and (original.width() > size or original.height() > size):
+        # Let the decoder downscale (JPEG can skip most of the IDCT work)
+        reader.setScaledSize(original.scaled(size, size, Qt.KeepAspectRatio))
+    with span("decode", item=source_file.name):
+        image = reader.read()
+    if image.isNull():
+        raise ValueError(f"Cannot decode {source_file}: {reader.errorString()}")
+    if image.width() > size or image.height() > size:
+        with span("scale", what="thumbnail"):
+            image = image.scaled(
+                QSize(size, size), Qt.KeepAspectRatio, Qt.SmoothTransformation
+            )
+    return image
+
+
+class ThumbnailCache:
+    """
+    In-memory LRU of encoded thumbnails keyed by (path, mtime, size, tier),
+    in front of the on-disk `ThumbnailStore` shared with other sessions.
+
+    A changed file gets a new key, so stale entries simply age out. Has no
+    size limit of its own: the `memory.MemoryGovernor` it is registered
+    with bounds it together with the other caches.
+    """
+
+    memory_name = "Thumbnails"
+    rebuild_cost = 0.25  # a scaled decode is much cheaper than a full one
+    governor = None
+
+    def __init__(self, store: ThumbnailStore = None):
+        self.store = store
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(source_file: Path, tier: int) -> tuple:
+        stat = source_file.stat()
+        return str(source_file), stat.st_mtime_ns, stat.st_size, tier
+
+    @staticmethod
+    def etag(key: tuple) -> str:
+        _path, mtime_ns, size, tier = key
+        return f'"{mtime_ns:x}-{size:x}-{tier}"'
+
+    def get(self, key: tuple):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries[key] = (entry[0], time.monotonic())
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: tuple, data: bytes) -> None:
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = (data, time.monotonic())
+            self.current_bytes += len(data)
+        if self.governor is not None:
+            self.governor.rebalance()
+
+    def oldest(self):
+        with self._lock:
+            if not self._entries:
+                return None
+            data, last_used = next(iter(self._entries.values()))
+            return last_used, len(data)
+
+    def evict_oldest(self) -> int:
+        with self._lock:
+            if not self._entries:
+                return 0
+            _key, (data, _used) = self._entries.popitem(last=False)
+            self.current_bytes -= len(data)
+            return len(data)
+
+    def fetch(self, source_file: Path, size: int):
+        tier = tier_for(size)
+        key = self.key(source_file, tier)
+        data = self.get(key)
+        if data is None and self.store is not None:
+            data = self.store.load(source_file, tier)
+        if data is None:
+            image = render_thumbnail(source_file, tier)
+            data = encode_thumbnail(image, source_file, source_file.stat())
+            if self.store is not None:
+                self.store.store(source_file, tier, data)
+        self.put(key, data)
+        return key, data
+
+
+class SortingService:
+    """
+    Source queue, album list and move journal shared by every client.
+    """
+
+    def __init__(
+        self,
+        source_directory: Path,
+        album_directory: Path,
+        extensions,
+        governor: MemoryGovernor = None,
+        store: ThumbnailStore = None,
+        album_settings: dict = None,
+    ):
+        self.source_directory = source_directory
+        self.album_directory = album_directory
+        self.extensions = image_extensions(extensions)
+        self.store = store if store is not None else ThumbnailStore()
+        self.trash_can = Trash()
+        self.thumbnails = ThumbnailCache(store=self.store)
+        self.governor = governor if governor is not None else MemoryGovernor()
+        self.governor.register(self.thumbnails)
+        self.albums = []
+        self.items = []
+        self._journal = []
+        self._lock = threading.RLock()
+        self.rescan()
+        self.stats = AlbumStats(album_directory, self.albums)
+        self.transcoder = None
+        if album_settings:
+            self.transcoder = TranscodePipeline(
+                {album_directory / name: s for name, s in album_settings.items()},
+                on_done=self._transcoded,
+            )
+
+    def rescan(self) -> None:
+        with span("album discovery"):
+            albums = sorted(
+                d.name
+                for d in self.album_directory.iterdir()
+                if is_album(d) and is_not_dotted(d)
+            )
+        if len(albums) > MAX_ALBUMS:
+            logger.warning(
+                f"Album directory {self.album_directory} has too many albums - truncating to {MAX_ALBUMS}"
+            )
+            albums = albums[:MAX_ALBUMS]
+        with span("scan"):
+            items = sorted(
+                f.name
+                for f in self.source_directory.iterdir()
+                if f.suffix.lower() in self.extensions and f.is_file()
+            )
+        with self._lock:
+            self.albums = albums
+            self.items = items
+        logger.info(
+            f"{len(items)} items found in {self.source_directory}, {len(albums)} albums"
+        )
+
+    def item_path(self, name: str) -> Path:
+        path = self.source_directory / name
+        if path.parent != self.source_directory or name not in self.items:
+            raise KeyError(name)
+        return path
+
+    def queue(self, offset: int, limit: int) -> dict:
+        with self._lock:
+            names = self.items[offset : offset + limit]
+            total = len(self.items)
+        page = []
+        for name in names:
+            try:
+                stat = (self.source_directory / name).stat()
+            except FileNotFoundError:
+                continue
+            page.append({"name": name, "size": stat.st_size, "mtime": stat.st_mtime})
+        return {"total": total, "offset": offset, "items": page}
+
+    def move(self, moves: list) -> list:
+        # Reject a malformed request before anything has been moved
+        if not isinstance(moves, list):
+            raise ValueError("moves must be a list")
+        for move in moves:
+            if not isinstance(move, dict) or not all(
+                isinstance(move.get(key), str) for key in ("item", "album")
+            ):
+                raise ValueError(f"malformed move {move!r}")
+        results = []
+        batch = []
+        with self._lock:
+            try:
+                for move in moves:
+                    name, album = move["item"], move["album"]
+                    try:
+                        source_file = self.item_path(name)
+                        if album not in self.albums:
+                            raise KeyError(album)
+                        destination = move_item(
+                            source_file,
+                            self.album_directory / album,
+                            self.transcoder,
+                            self.stats,
+                        )
+                    except (KeyError, OSError) as e:
+                        logger.error(f"Move of {name} to {album} failed: {e}")
+                        results.append({"item": name, "album": album, "error": str(e)})
+                        continue
+                    self.items.remove(name)
+                    self.store.rekey(source_file, destination)
+                    batch.append((source_file, destination))
+                    results.append({"item": name, "album": album})
+            finally:
+                if batch:
+                    self._journal.append(batch)
+                    del self._journal[:-MAX_UNDO]
+        return results
+
+    def undo(self, count: int = 1) -> list:
+        restored = []
+        with self._lock:
+            for _i in range(min(count, len(self._journal))):
+                failed = []
+                for source_file, destination in reversed(self._journal.pop()):
+                    try:
+                        size = destination.stat().st_size
+                        dir_mtime = destination.parent.stat().st_mtime_ns
+                        restored_file = move_item(destination, source_file.parent)
+                        self.stats.record_remove(destination, size, dir_mtime)
+                        self.store.rekey(destination, restored_file)
+                    except OSError as e:
+                        logger.error(f"Undo of {destination} failed: {e}")
+                        failed.insert(0, (source_file, destination))
+                        continue
+                    self.items.append(restored_file.name)
+                    restored.append(restored_file.name)
+                if failed:
+                    # Keep what could not be restored so it can be retried
+                    self._journal.append(failed)
+                    break
+            self.items.sort()
+        return restored
+
+    def trash(self, names: list) -> list:
+        results = []
+        with self._lock:
+            paths = []
+            for name in names:
+                try:
+                    paths.append(self.item_path(name))
+                except KeyError as e:
+                    results.append({"item": name, "size": 0, "error": f"unknown {e}"})
+            for result in self.trash_can.trash_batch(paths):
+                name = result.source.name
+                if result.error is not None:
+                    error = str(result.error)
+                    results.append({"item": name, "size": 0, "error": error})
+                    continue
+                self.items.remove(name)
+                results.append({"item": name, "size": result.size})
+        return results
+
+    def _transcoded(self, result) -> None:
+        if result.error is None:
+            self.stats.record_resize(
+                result.output, result.bytes_out - result.bytes_in, result.dir_mtime
+            )
+        if result.error is None and result.output != result.source:
+            self.store.rekey(result.source, result.output)
+            # Undo has to move the file the transcoder left behind
+            with self._lock:
+                for batch in self._journal:
+                    for i, (source_file, destination) in enumerate(batch):
+                        if destination == result.source:
+                            batch[i] = (source_file, result.output)
+
+    def shutdown(self) -> None:
+        if self.transcoder is not None:
+            self.transcoder.shutdown()
+        self.stats.save()
+        self.store.flush()
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    server_version = "imsd/0.1"
+    service: SortingService = None
+    allowed_hosts = LOOPBACK_HOSTS
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def _send_json(self, payload, status: HTTPStatus = HTTPStatus.OK) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _refuse(self, post: bool = False) -> bool:
+        """
+        Answer and return True for requests that did not come from a local
+        client: a foreign Host (DNS rebinding), a foreign Origin, or a POST
+        body a cross-site form could send.
+        """
+        host = urlparse(f"//{self.headers.get('Host', '')}").hostname
+        if host not in self.allowed_hosts:
+            self._send_json({"error": "unexpected host"}, HTTPStatus.FORBIDDEN)
+            return True
+        origin = self.headers.get("Origin")
+        if origin is not None and urlparse(origin).hostname not in self.allowed_hosts:
+            self._send_json({"error": "unexpected origin"}, HTTPStatus.FORBIDDEN)
+            return True
+        content_type = self.headers.get("Content-Type", "")
+        if post and content_type.split(";")[0].strip().lower() != "application/json":
+            self._send_json(
+                {"error": "expected application/json"},
+                HTTPStatus.UNSUPPORTED_MEDIA_TYPE,
+            )
+            return True
+        return False
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        if length == 0:
+            return {}
+        return json.loads(self.rfile.read(length))
+
+    def do_GET(self):
+        if self._refuse():
+            return
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            if url.path == "/status":
+                self._send_json(
+                    {
+                        "version": VERSION_INFO,
+                        "source_directory": str(self.service.source_directory),
+                        "album_directory": str(self.service.album_directory),
+                        "total": len(self.service.items),
+                    }
+                )
+            elif url.path == "/albums":
+                stats = {a: self.service.stats.get(a) for a in self.service.albums}
+                self._send_json({"albums": self.service.albums, "stats": stats})
+            elif url.path == "/queue":
+                offset = max(0, int(query.get("offset", 0)))
+                limit = min(MAX_PAGE_SIZE, int(query.get("limit", DEFAULT_PAGE_SIZE)))
+                self._send_json(self.service.queue(offset, max(0, limit)))
+            elif url.path == "/thumbnail":
+                self._send_thumbnail(query)
+            else:
+                self._send_json({"error": "not found"}, HTTPStatus.NOT_FOUND)
+        except (KeyError, FileNotFoundError) as e:
+            self._send_json({"error": f"unknown item {e}"}, HTTPStatus.NOT_FOUND)
+        except ValueError as e:
+            self._send_json({"error": str(e)}, HTTPStatus.BAD_REQUEST)
+
+    def _send_thumbnail(self, query: dict) -> None:
+        source_file = self.service.item_path(query["item"])
+        size = int(query.get("size", DEFAULT_THUMBNAIL_SIZE))
+        key = ThumbnailCache.key(source_file, tier_for(size))
+        etag = ThumbnailCache.etag(key)
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        _key, data = self.service.thumbnails.fetch(source_file, size)
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "private, max-age=3600")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if self._refuse(post=True):
+            return
+        url = urlparse(self.path)
+        try:
+            payload = self._read_json()
+            if url.path == "/move":
+                self._send_json({"results": self.service.move(payload["moves"])})
+            elif url.path == "/undo":
+                restored = self.service.undo(int(payload.get("count", 1)))
+                self._send_json({"restored": restored})
+            elif url.path == "/trash":
+                self._send_json({"results": self.service.trash(payload["items"])})
+            elif url.path == "/rescan":
+                self.service.rescan()
+                self._send_json({"total": len(self.service.items)})
+            else:
+                self._send_json({"error": "not found"}, HTTPStatus.NOT_FOUND)
+        except (KeyError, TypeError, ValueError) as e:
+            self._send_json({"error": f"bad request: {e}"}, HTTPStatus.BAD_REQUEST)
+
+
+class ImgSackClient:
+    """
+    Thin client for the daemon API, usable from the Qt window or scripts.
+    """
+
+    def __init__(
+        self,
+        base_url: str = f"http://{DEFAULT_HOST}:{DEFAULT_PORT}",
+        timeout: float = CLIENT_TIMEOUT,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _get(self, path: str, **params):
+        url = f"{self.base_url}{path}?{urlencode(params)}"
+        with urlopen(url, timeout=self.timeout) as response:
+            return response.read()
+
+    def _post(self, path: str, payload: dict) -> dict:
+        request = Request(
+            f"{self.base_url}{path}",
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        with urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def status(self) -> dict:
+        return json.loads(self._get("/status"))
+
+    def albums(self) -> list:
+        return json.loads(self._get("/albums"))["albums"]
+
+    def album_stats(self) -> dict:
+        return json.loads(self._get("/albums"))["stats"]
+
+    def queue(self, offset: int = 0, limit: int = DEFAULT_PAGE_SIZE) -> dict:
+        return json.loads(self._get("/queue", offset=offset, limit=limit))
+
+    def all_items(self) -> list:
+        items = []
+        while True:
+            page = self.queue(len(items), MAX_PAGE_SIZE)
+            items.extend(item["name"] for item in page["items"])
+            if not page["items"] or len(items) >= page["total"]:
+                return items
+
+    def thumbnail(self, item: str, size: int = DEFAULT_THUMBNAIL_SIZE) -> bytes:
+        return self._get("/thumbnail", item=item, size=size)
+
+    def move(self, moves: list) -> list:
+        return self._post("/move", {"moves": moves})["results"]
+
+    def undo(self, count: int = 1) -> list:
+        return self._post("/undo", {"count": count})["restored"]
+
+    def trash(self, items: list) -> list:
+        return self._post("/trash", {"items": items})["results"]
+
+    def rescan(self) -> int:
+        return self._post("/rescan", {})["total"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=f"{VERSION_INFO} - sorting daemon")
+    parser.add_argument(
+        "-s", "--source", help="source directory for images", default="."
+    )
+    parser.add_argument(
+        "-a", "--albums", help="directory for album folders", default=None
+    )
+    parser.add_argument("-c", "--config", help="configuration file", default=None)
+    parser.add_argument(
+        "-e",
+        "--extensions",
+        help="image extensions to queue, e.g. -e .jpg .png",
+        nargs="+",
+        default=DEFAULT_EXTENSIONS,
+    )
+    parser.add_argument("--host", help="address to listen on", default=DEFAULT_HOST)
+    parser.add_argument(
+        "-p", "--port", help="port to listen on", type=int, default=DEFAULT_PORT
+    )
+    parser.add_argument(
+        "-m",
+        "--memory-budget",
+        help="memory budget for all caches, e.g. 512M or 2G",
+        default=None,
+    )
+    parser.add_argument(
+        "-t",
+        "--thumbnail-cache",
+        help="size limit of the on-disk thumbnail cache, e.g. 512M",
+        default=THUMBNAIL_CACHE_MAX_BYTES,
+    )
+    parser.add_argument(
+        "--profile",
+        help="write sampling profile and span trace, transcode workers included, "
+        "to this directory on exit",
+        nargs="?",
+        const="imgsack-profile",
+        default=None,
+    )
+    args = parser.parse_args()
+
+    if args.profile is not None:
+        profiler.start(Path(args.profile).expanduser().resolve())
+
+    extensions = args.extensions
+    album_settings = {}
+    memory_budget = DEFAULT_MEMORY_BUDGET
+    if args.config is not None:
+        config_file = Path(args.config).expanduser().resolve()
+        if not config_file.exists():
+            logger.critical(f"Configuration file {args.config} does not exist")
+            exit(1)
+        config = json.loads(config_file.read_text())
+        source_directory = Path(config["source_directory"]).expanduser().resolve()
+        album_directory = Path(config["output_directory"]).expanduser().resolve()
+        extensions = config.get("extensions", DEFAULT_EXTENSIONS)
+        memory_budget = config.get("memory_budget", memory_budget)
+        for album in config["albums"]:
+            if "transcode" in album:
+                name = album["directory"].strip("/")
+                album_settings[name] = settings_from_config(album["transcode"])
+    else:
+        source_directory = Path(args.source).expanduser().resolve()
+        if args.albums is None:
+            album_directory = source_directory
+        else:
+            album_directory = Path(args.albums).expanduser().resolve()
+    if not source_directory.exists():
+        logger.critical(f"Source directory {source_directory} does not exist")
+        exit(1)
+    if not album_directory.exists():
+        logger.critical(f"Album directory {album_directory} does not exist")
+        exit(1)
+
+    if args.memory_budget is not None:
+        memory_budget = args.memory_budget
+    try:
+        governor = MemoryGovernor(parse_size(memory_budget))
+    except ValueError as e:
+        logger.critical(f"Memory budget: {e}")
+        exit(1)
+    try:
+        store = ThumbnailStore(max_bytes=parse_size(args.thumbnail_cache))
+    except ValueError as e:
+        logger.critical(f"Thumbnail cache size: {e}")
+        exit(1)
+    governor.start_monitor()
+    service = SortingService(
+        source_directory,
+        album_directory,
+        extensions,
+        governor,
+        store,
+        album_settings,
+    )
+    ServiceRequestHandler.service = service
+    listen_host = args.host.strip("[]").lower()
+    ServiceRequestHandler.allowed_hosts = LOOPBACK_HOSTS | {listen_host}
+    server = ThreadingHTTPServer((args.host, args.port), ServiceRequestHandler)
+    logger.info(f"imsd listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("imsd shutting down")
+    server.server_close()
+    service.shutdown()
+    profiler.stop()
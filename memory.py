@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+One memory budget shared by every in-process cache.
+
+Caches register with a `MemoryGovernor` and call `rebalance()` after they
+grow; they have no size limits of their own, so the budget is the only
+one. A registered cache provides:
+
+    memory_name       label shown in the status bar
+    rebuild_cost      rough seconds to rebuild one entry (decode vs. lookup)
+    current_bytes     bytes currently held
+    oldest()          (last_used, nbytes) of its least recently used entry, or None
+    evict_oldest()    drop that entry and return the bytes freed
+
+When over budget the governor repeatedly evicts, across all caches, the
+entry with the highest age * size / rebuild_cost, so large, stale and cheap
+entries go first. The effective budget also follows the cgroup memory limit
+and shrinks while the kernel reports memory pressure.
+"""
+
+import re
+import threading
+import time
+from pathlib import Path
+
+from d4mnLogger import logger
+
+DEFAULT_MEMORY_BUDGET = 1024 * 1024 * 1024
+CGROUP_SHARE = 0.5  # never plan to use more than this much of a cgroup limit
+PRESSURE_THRESHOLD = 10.0  # "some avg10" percentage that counts as pressure
+PRESSURE_SHRINK = 0.5
+MONITOR_INTERVAL = 2.0
+
+_CGROUP_ROOT = Path("/sys/fs/cgroup")
+_PROC_CGROUP = Path("/proc/self/cgroup")
+_SYSTEM_PRESSURE = Path("/proc/pressure/memory")
+_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_size(size) -> int:
+    """
+    Turn 1073741824, "1073741824", "1024M" or "1G" into bytes.
+    """
+    if isinstance(size, int):
+        return size
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", str(size), re.I)
+    if match is None:
+        raise ValueError(f"Invalid size {size}")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()])
+
+
+def cgroup_directories() -> list:
+    """
+    (directory, mount, limit file name) of this process's memory cgroup,
+    from /proc/self/cgroup: the v2 unified hierarchy and/or v1's memory
+    controller.
+    """
+    try:
+        lines = _PROC_CGROUP.read_text().splitlines()
+    except OSError:
+        return []
+    found = []
+    for line in lines:
+        parts = line.split(":", 2)
+        if len(parts) != 3:
+            continue
+        _hierarchy, controllers, path = parts
+        if controllers == "":
+            mount, limit_name = _CGROUP_ROOT, "memory.max"
+        elif "memory" in controllers.split(","):
+            mount, limit_name = _CGROUP_ROOT / "memory", "memory.limit_in_bytes"
+        else:
+            continue
+        found.append((mount / path.strip("/"), mount, limit_name))
+    return found
+
+
+def cgroup_memory_limit():
+    """
+    The tightest memory limit on this process's cgroup or its ancestors.
+    """
+    limits = []
+    for directory, mount, limit_name in cgroup_directories():
+        while True:
+            try:
+                value = (directory / limit_name).read_text().strip()
+            except OSError:
+                value = ""
+            # cgroup v2 says "max", v1 uses a huge number for "unlimited"
+            if value.isdigit() and int(value) < 1 << 60:
+                limits.append(int(value))
+            if directory == mount or directory == directory.parent:
+                break
+            directory = directory.parent
+    return min(limits) if limits else None
+
+
+def memory_pressure():
+    """
+    "some avg10" memory pressure of this process's cgroup, else of the system.
+    """
+    pressure_files = [
+        directory / "memory.pressure"
+        for directory, _mount, limit_name in cgroup_directories()
+        if limit_name == "memory.max"
+    ]
+    for pressure_file in pressure_files + [_SYSTEM_PRESSURE]:
+        try:
+            for line in pressure_file.read_text().splitlines():
+                if line.startswith("some"):
+                    return float(re.search(r"avg10=([\d.]+)", line).group(1))
+        except (OSError, AttributeError):
+            continue
+    return None
+
+
+class MemoryGovernor:
+    def __init__(self, budget: int = DEFAULT_MEMORY_BUDGET):
+        self.budget = budget
+        self.effective_budget = budget
+        self.under_pressure = False
+        self._caches = []
+        self._lock = threading.RLock()
+        self._monitor = None
+        self._stopping = threading.Event()
+        self.update_limits()
+
+    def register(self, cache) -> None:
+        with self._lock:
+            self._caches.append(cache)
+        cache.governor = self
+        logger.debug(f"MemoryGovernor registered {cache.memory_name}")
+
+    def usage(self) -> dict:
+        return {cache.memory_name: cache.current_bytes for cache in self._caches}
+
+    def total(self) -> int:
+        return sum(cache.current_bytes for cache in self._caches)
+
+    def update_limits(self) -> None:
+        budget = self.budget
+        limit = cgroup_memory_limit()
+        if limit is not None:
+            budget = min(budget, int(limit * CGROUP_SHARE))
+        pressure = memory_pressure()
+        self.under_pressure = pressure is not None and pressure >= PRESSURE_THRESHOLD
+        if self.under_pressure:
+            budget = int(budget * PRESSURE_SHRINK)
+        if budget != self.effective_budget:
+            logger.info(
+                f"Memory budget now {budget} bytes"
+                + (f" (pressure avg10={pressure})" if self.under_pressure else "")
+            )
+            self.effective_budget = budget
+
+    def rebalance(self) -> int:
+        freed = 0
+        with self._lock:
+            while self.total() > self.effective_budget:
+                now = time.monotonic()
+                victim, best = None, -1.0
+                for cache in self._caches:
+                    oldest = cache.oldest()
+                    if oldest is None:
+                        continue
+                    last_used, nbytes = oldest
+                    score = (now - last_used + 1.0) * nbytes / cache.rebuild_cost
+                    if score > best:
+                        victim, best = cache, score
+                if victim is None:
+                    break
+                released = victim.evict_oldest()
+                if released <= 0:
+                    break
+                freed += released
+        return freed
+
+    def start_monitor(self) -> None:
+        if self._monitor is None:
+            self._monitor = threading.Thread(
+                target=self._watch, name="memory", daemon=True
+            )
+            self._monitor.start()
+
+    def stop_monitor(self) -> None:
+        self._stopping.set()
+
+    def _watch(self) -> None:
+        while not self._stopping.wait(MONITOR_INTERVAL):
+            self.update_limits()
+            self.rebalance()
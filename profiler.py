@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Built-in profiling mode.
+
+A background thread samples every thread's Python stack with
+`sys._current_frames()` and code marks named spans with `span("decode")`.
+On `stop()` two files are written to the output directory:
+
+    imgsack.collapsed    collapsed stacks, one "thread;frame;frame count" per
+                         line (feed to flamegraph.pl or speedscope)
+    imgsack.trace.json   Chrome trace events for the spans (chrome://tracing,
+                         Perfetto)
+
+Process pools created with `worker_initializer()` profile their workers
+too: each worker leaves its own data behind when it exits, and `stop()`
+merges it in, rooted at "worker-<pid>" in the collapsed stacks and as its
+own process in the trace.
+
+When profiling is off `span()` is a shared no-op context manager, so the
+instrumentation can stay in place.
+"""
+
+import json
+import multiprocessing.util
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+from d4mnLogger import logger
+
+SAMPLE_INTERVAL = 0.005  # seconds
+MAX_STACK_DEPTH = 128
+COLLAPSED_FILE = "imgsack.collapsed"
+TRACE_FILE = "imgsack.trace.json"
+WORKER_FILE_PREFIX = "imgsack-worker-"
+
+_profiler = None
+_NO_SPAN = nullcontext()
+
+
+class Profiler:
+    def __init__(
+        self,
+        output_directory: Path,
+        interval: float = SAMPLE_INTERVAL,
+        origin: float = None,
+    ):
+        self.output_directory = output_directory
+        self.interval = interval
+        self.samples = Counter()
+        self.thread_names = {}
+        self.events = []
+        self._events_lock = threading.Lock()
+        # Workers share the parent's origin; perf_counter is system wide here
+        self.origin = origin if origin is not None else time.perf_counter()
+        self._stopping = threading.Event()
+        self._sampler = threading.Thread(
+            target=self._sample, name="profiler", daemon=True
+        )
+
+    def start(self) -> None:
+        self._sampler.start()
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        while not self._stopping.wait(self.interval):
+            self.thread_names.update((t.ident, t.name) for t in threading.enumerate())
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    location = f"{Path(code.co_filename).name}:{frame.f_lineno}"
+                    stack.append(f"{code.co_name} ({location})")
+                    frame = frame.f_back
+                stack.append(self.thread_names.get(ident, f"thread-{ident}"))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def _timestamp(self) -> float:
+        return (time.perf_counter() - self.origin) * 1_000_000
+
+    @contextmanager
+    def span(self, name: str, **args):
+        start = self._timestamp()
+        try:
+            yield
+        finally:
+            event = {
+                "name": name,
+                "ph": "X",
+                "ts": start,
+                "dur": self._timestamp() - start,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+            }
+            if args:
+                event["args"] = {k: str(v) for k, v in args.items()}
+            with self._events_lock:
+                self.events.append(event)
+
+    def _trace_events(self) -> list:
+        with self._events_lock:
+            events = list(self.events)
+        for ident, name in self.thread_names.items():
+            events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": os.getpid(),
+                    "tid": ident,
+                    "args": {"name": name},
+                }
+            )
+        return events
+
+    def _halt(self) -> None:
+        self._stopping.set()
+        self._sampler.join()
+        self.output_directory.mkdir(parents=True, exist_ok=True)
+
+    def save_worker(self) -> None:
+        """
+        Stop and leave this worker process's data for the parent to merge.
+        """
+        self._halt()
+        worker_file = self.output_directory / f"{WORKER_FILE_PREFIX}{os.getpid()}.json"
+        worker_file.write_text(
+            json.dumps({"samples": self.samples, "events": self._trace_events()})
+        )
+
+    def _merge_workers(self, samples: Counter, events: list) -> int:
+        workers = 0
+        for worker_file in self.output_directory.glob(f"{WORKER_FILE_PREFIX}*.json"):
+            pid = worker_file.stem[len(WORKER_FILE_PREFIX) :]
+            try:
+                data = json.loads(worker_file.read_text())
+                worker_file.unlink()
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping worker profile {worker_file}: {e}")
+                continue
+            for stack, count in data["samples"].items():
+                samples[f"worker-{pid};{stack}"] += count
+            events.extend(data["events"])
+            events.append(
+                {
+                    "name": "process_name",
+                    "ph": "M",
+                    "pid": int(pid),
+                    "args": {"name": f"worker-{pid}"},
+                }
+            )
+            workers += 1
+        return workers
+
+    def stop(self) -> None:
+        self._halt()
+        samples = Counter(self.samples)
+        events = self._trace_events()
+        workers = self._merge_workers(samples, events)
+
+        collapsed = self.output_directory / COLLAPSED_FILE
+        collapsed.write_text(
+            "".join(f"{stack} {count}\n" for stack, count in samples.items())
+        )
+        trace = self.output_directory / TRACE_FILE
+        trace.write_text(json.dumps({"traceEvents": events}))
+        logger.info(
+            f"Profile written to {collapsed} ({sum(samples.values())} samples) "
+            f"and {trace} ({len(self.events)} spans, {workers} worker processes)"
+        )
+
+
+def start(output_directory: Path) -> Profiler:
+    global _profiler
+    _profiler = Profiler(output_directory)
+    _profiler.start()
+    logger.info(f"Profiling to {output_directory}")
+    return _profiler
+
+
+def worker_initializer() -> tuple:
+    """
+    `(initializer, initargs)` for a process pool, so its workers are
+    profiled too while profiling is on.
+    """
+    if _profiler is None:
+        return None, ()
+    return start_worker, (_profiler.output_directory, _profiler.origin)
+
+
+def start_worker(output_directory: Path, origin: float) -> None:
+    global _profiler
+    _profiler = Profiler(output_directory, origin=origin)
+    _profiler.start()
+    # Pool workers exit without running atexit handlers, but do run these
+    multiprocessing.util.Finalize(None, _profiler.save_worker, exitpriority=10)
+
+
+def stop() -> None:
+    global _profiler
+    if _profiler is not None:
+        profiler, _profiler = _profiler, None
+        profiler.stop()
+
+
+def span(name: str, **args):
+    """
+    Time the `with` block as a named span when profiling, otherwise do nothing.
+    """
+    if _profiler is None:
+        return _NO_SPAN
+    return _profiler.span(name, **args)
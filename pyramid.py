@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Resolution pyramids for displayed images.
+
+Each decoded image is kept as a short chain of pre-downscaled levels (full,
+1/2, 1/4, ...). Resizing or zooming resamples from the nearest level that is
+still at least as large as the target, instead of from the full image, and
+only the part that is actually visible.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from PySide6.QtCore import QRect, QSize, Qt
+from PySide6.QtGui import QImage, QImageReader
+
+from d4mnLogger import logger
+from profiler import span
+
+PYRAMID_MIN_SIDE = 256  # stop adding levels below this
+
+
+class ImagePyramid:
+    def __init__(self, image: QImage):
+        self.levels = [image]
+        with span("scale", what="pyramid"):
+            while min(image.width(), image.height()) // 2 >= PYRAMID_MIN_SIDE:
+                image = image.scaled(
+                    image.width() // 2,
+                    image.height() // 2,
+                    Qt.IgnoreAspectRatio,
+                    Qt.SmoothTransformation,
+                )
+                self.levels.append(image)
+        self.nbytes = sum(level.sizeInBytes() for level in self.levels)
+
+    @classmethod
+    def load(cls, p: Path):
+        with span("decode", item=p.name):
+            reader = QImageReader(str(p))
+            reader.setAutoTransform(True)
+            image = reader.read()
+        if image.isNull():
+            logger.error(f"Cannot decode {p}: {reader.errorString()}")
+            return None
+        return cls(image)
+
+    def size(self) -> QSize:
+        return self.levels[0].size()
+
+    def level_for(self, target: QSize) -> QImage:
+        """
+        The smallest level that is at least `target` in both dimensions.
+        """
+        for level in reversed(self.levels):
+            if level.width() >= target.width() and level.height() >= target.height():
+                return level
+        return self.levels[0]
+
+    def scaled(self, target: QSize, smooth: bool = False) -> QImage:
+        fitted = self.size().scaled(target, Qt.KeepAspectRatio)
+        mode = Qt.SmoothTransformation if smooth else Qt.FastTransformation
+        with span("scale", smooth=smooth):
+            return self.level_for(fitted).scaled(fitted, Qt.IgnoreAspectRatio, mode)
+
+    def region(self, rect: QRect, target: QSize, smooth: bool = False) -> QImage:
+        """
+        `rect` (in full-size pixels) scaled to `target`. Only that part of the
+        smallest sufficient level is resampled, so the result is never larger
+        than `target` however far the view is zoomed in.
+        """
+        size = self.size()
+        scale = max(target.width() / rect.width(), target.height() / rect.height())
+        level = self.level_for(
+            QSize(math.ceil(size.width() * scale), math.ceil(size.height() * scale))
+        )
+        f = level.width() / size.width()
+        source = QRect(
+            int(rect.x() * f),
+            int(rect.y() * f),
+            max(1, round(rect.width() * f)),
+            max(1, round(rect.height() * f)),
+        )
+        mode = Qt.SmoothTransformation if smooth else Qt.FastTransformation
+        with span("scale", smooth=smooth):
+            return level.copy(source).scaled(target, Qt.IgnoreAspectRatio, mode)
+
+
+class PyramidCache:
+    """
+    LRU of `ImagePyramid`s keyed by path.
+
+    Has no size limit of its own: register it with a `memory.MemoryGovernor`,
+    whose budget bounds it together with the other caches. The pinned
+    pyramid (the one on screen) is never evicted, however stale it looks.
+    """
+
+    memory_name = "Images"
+    rebuild_cost = 1.0  # a full decode plus the pyramid levels
+    governor = None
+
+    def __init__(self):
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._pinned = None
+        self._lock = threading.Lock()
+
+    def pin(self, p: Path) -> None:
+        """
+        Keep `p` (None for nothing) cached, even before it has been put.
+        """
+        with self._lock:
+            self._pinned = p
+
+    def _victim(self):
+        # Oldest entry that may be evicted
+        for p in self._entries:
+            if p != self._pinned:
+                return p
+        return None
+
+    def __contains__(self, p: Path) -> bool:
+        # Does not count as a use
+        with self._lock:
+            return p in self._entries
+
+    def get(self, p: Path):
+        with self._lock:
+            entry = self._entries.get(p)
+            if entry is None:
+                return None
+            self._entries[p] = (entry[0], time.monotonic())
+            self._entries.move_to_end(p)
+            return entry[0]
+
+    def put(self, p: Path, pyramid: ImagePyramid) -> None:
+        with self._lock:
+            old = self._entries.pop(p, None)
+            if old is not None:
+                self.current_bytes -= old[0].nbytes
+            self._entries[p] = (pyramid, time.monotonic())
+            self.current_bytes += pyramid.nbytes
+        if self.governor is not None:
+            self.governor.rebalance()
+
+    def discard(self, p: Path) -> None:
+        with self._lock:
+            old = self._entries.pop(p, None)
+            if old is not None:
+                self.current_bytes -= old[0].nbytes
+
+    def oldest(self):
+        with self._lock:
+            victim = self._victim()
+            if victim is None:
+                return None
+            pyramid, last_used = self._entries[victim]
+            return last_used, pyramid.nbytes
+
+    def evict_oldest(self) -> int:
+        with self._lock:
+            victim = self._victim()
+            if victim is None:
+                return 0
+            pyramid, _used = self._entries.pop(victim)
+            self.current_bytes -= pyramid.nbytes
+            return pyramid.nbytes
@@ -1,14 +1,9 @@
 #!/usr/bin/env python3
 
-PROGRAM_NAME = "ImageSack"
-PROGRAM_VERSION = "0.0.1rNone"
-PYTHON_VERSION = "3.9"
-VERSION_INFO = f"{PROGRAM_NAME} v{PROGRAM_VERSION} -  Python {PYTHON_VERSION}"
-
 import argparse
 import json
 import logging
-import os
+import threading
 from enum import Enum
 from pathlib import Path
 
@@ -17,6 +12,29 @@ from PySide6.QtGui import *
 from PySide6.QtWidgets import *
 from rich.logging import RichHandler
 
+import profiler
+from albumstats import AlbumStats
+from grouping import DEFAULT_GROUP_GAP, group_items
+from imscore import (
+    DEFAULT_EXTENSIONS,
+    MAX_ALBUMS,
+    MIN_ALBUMS,
+    PROGRAM_NAME,
+    PROGRAM_VERSION,
+    VERSION_INFO,
+    format_bytes,
+    image_extensions,
+    is_album,
+    is_not_dotted,
+    move_items,
+)
+from transcode import TranscodePipeline, settings_from_config
+from trash import TrashResult, TrashWorker
+from memory import DEFAULT_MEMORY_BUDGET, MemoryGovernor, parse_size
+from profiler import span
+from thumbcache import ThumbnailStore
+from widgets import ImageView, StatusBar
+
 logging.basicConfig(
     level="NOTSET",
     format="%(message)s",
@@ -29,19 +47,6 @@ logging.info(f"{VERSION_INFO} started")
 
 NO_ALBUM_MESSAGE = "No album defined"
 NO_ALBUM_BUTTON_TITLE = "-"
-DEFAULT_EXTENSIONS = [
-    ".jpg",
-    ".jpeg",
-    ".png",
-    ".gif",
-    ".bmp",
-    ".tif",
-    ".tiff",
-    ".webp",
-    ".svg",
-]
-MIN_ALBUMS = 9
-MAX_ALBUMS = 36  # no mod, shift, alt, ctrl * 9 (on the numeric keypad)
 
 
 class FontSize(Enum):
@@ -55,6 +60,7 @@ class FontSize(Enum):
 
 QUICK_MESSAGE_TIMER = 3000
 MESSAGE_TIMER = QUICK_MESSAGE_TIMER * 2
+MEMORY_STATUS_TIMER = 1000
 # QT swaps key names for modifiers on MacOS. This switches them back.
 MODIFIER_KEYS = ["", "Shift", "Ctrl", "Alt"]
 KEYPRESS_VALUES = [-1, 16777248, 16777250, 16777251]
@@ -62,19 +68,6 @@ DEBUG = True
 RIGHT_COLUMN_WIDTH = 384
 
 
-def is_album(p: Path) -> bool:
-    return os.path.isdir(p.expanduser())
-
-
-def is_not_dotted(p: Path) -> bool:
-    return p.name[0] != "."
-
-
-def move_item(source_file: Path, destination_folder: Path) -> None:
-    logger.info(f"Moving {source_file} to {destination_folder}")
-    source_file.rename(destination_folder / source_file.name)
-
-
 class StatusWidget(QWidget):
     def __init__(self, working_directory: Path = "Testing/", parent=None):
         super().__init__(parent)
@@ -92,8 +85,11 @@ class StatusWidget(QWidget):
 
 
 class LabelSetWidget(QFrame):
+    album_selected = Signal(str)
+
     def __init__(self, title: str, buttons=None, parent=None):
         super().__init__(parent)
+        self.album_buttons = {}
         if buttons is None:
             logger.critical("Buttons cannot be None in LabelSetWidget.__init__")
             exit(1)
@@ -113,6 +109,13 @@ class LabelSetWidget(QFrame):
             button = QPushButton(f"{key_counter}. {button_text}")
             button.setStyleSheet(f"font-size: {FontSize.NORMAL.value}px;")
             button.setShortcut(QKeySequence(f"{key_counter}"))
+            if button_text == NO_ALBUM_BUTTON_TITLE:
+                button.setDisabled(True)
+            else:
+                button.clicked.connect(
+                    lambda _=False, name=button_text: self.album_selected.emit(name)
+                )
+                self.album_buttons[button_text] = (key_counter, button)
             layout.addWidget(button)
             key_counter += 1
 
@@ -128,6 +131,32 @@ class LabelSetWidget(QFrame):
         layout.setAlignment(Qt.AlignmentFlag.AlignTop)
         self.setLayout(layout)
 
+    def set_album_stats(self, album: str, stats: dict) -> None:
+        if album not in self.album_buttons:
+            return
+        key, button = self.album_buttons[album]
+        text = f"{key}. {album}"
+        if stats is not None:
+            text += f"  ({stats['count']} · {format_bytes(stats['bytes'])}"
+            if stats["newest"]:
+                newest = QDateTime.fromSecsSinceEpoch(int(stats["newest"]))
+                text += f" · {newest.toString('yyyy-MM-dd')}"
+            text += ")"
+        button.setText(text)
+
+
+class WorkerSignals(QObject):
+    # Workers call back on their own threads; these hop to the GUI thread
+    batch_done = Signal(object)
+    empty_progress = Signal(object)
+    transcode_done = Signal(object)
+    groups_ready = Signal(object)
+    album_stats_changed = Signal(str)
+    daemon_moved = Signal(str, object, object)  # album, group, failed items
+    daemon_trashed = Signal(object)
+    daemon_undone = Signal(object)  # restored names, or the error
+    daemon_stats_ready = Signal(object)
+
 
 class MainWindow(QMainWindow):
     def __init__(
@@ -135,28 +164,48 @@ class MainWindow(QMainWindow):
         source_dir: Path,
         album_dir: Path,
         album_lst: list,
+        item_lst: list = None,
+        album_settings: dict = None,
+        group_gap: float = DEFAULT_GROUP_GAP,
+        governor: MemoryGovernor = None,
+        client=None,
         parent=None,
     ):
         logger.debug(f"MainWindow got source_dir: {source_dir}")
         logger.debug(f"MainWindow got album_dir: {album_dir}")
         logger.debug(f"MainWindow got album_lst: {album_lst}")
 
+        self.source_dir = source_dir
+        self.album_dir = album_dir
+        # An imsd.ImgSackClient; the daemon then does all moves and thumbnails
+        self.client = client
+        self.items = list(item_lst) if item_lst is not None else []
+        self.current_item = 0
+        self.groups = {}  # item -> set of the items in its burst
+
         super().__init__(parent=parent)
 
         self.setWindowTitle("ImgSack")
 
         main_layout = QHBoxLayout()
 
-        image_label = QLabel(
+        self.governor = governor if governor is not None else MemoryGovernor()
+        self.thumbnails = ThumbnailStore() if client is None else None
+        self.image_label = ImageView(
+            thumbnails=self.thumbnails,
+            previews=self.daemon_preview if client is not None else None,
+        )
+        self.governor.register(self.image_label.cache)
+        self.image_label.setText(
             "ImgSack\nAlbert Freeman\nhttps://github.com/drivigmenuts/ImgSack"
         )
-        image_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        image_label.setMinimumWidth(768)
-        image_label.setMinimumHeight(768)
+        self.image_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.image_label.setMinimumWidth(768)
+        self.image_label.setMinimumHeight(768)
         if DEBUG:
             logger.debug(r"Adding frame")
-            image_label.setFrameShape(QFrame.Shape.Box)
-        main_layout.addWidget(image_label)
+            self.image_label.setFrameShape(QFrame.Shape.Box)
+        main_layout.addWidget(self.image_label)
 
         self.label_key_layout = QStackedLayout()
         # TODO: do this as an iterable?
@@ -168,14 +217,19 @@ class MainWindow(QMainWindow):
         self.label_key_layout.addWidget(labels_ctrl)
         labels_alt = LabelSetWidget("Alt", album_lst[27:36])
         self.label_key_layout.addWidget(labels_alt)
+        self.label_sets = [labels_none, labels_shift, labels_ctrl, labels_alt]
+        for labels in self.label_sets:
+            labels.album_selected.connect(self.move_to_album)
 
         utility_keys_layout = QHBoxLayout()
         skip_button_0 = QPushButton("0 - Skip")
         skip_button_0.setStyleSheet(f"font-size: {FontSize.NORMAL.value}px;")
         skip_button_0.setShortcut(QKeySequence("0"))
+        skip_button_0.clicked.connect(self.skip_item)
         trash_button_decimal = QPushButton(". - Trash")
         trash_button_decimal.setStyleSheet(f"font-size: {FontSize.NORMAL.value}px;")
         trash_button_decimal.setShortcut(QKeySequence("."))
+        trash_button_decimal.clicked.connect(self.trash_item)
 
         utility_keys_layout.addWidget(skip_button_0)
         utility_keys_layout.addWidget(trash_button_decimal)
@@ -199,10 +253,358 @@ class MainWindow(QMainWindow):
 
         self.setCentralWidget(central_widget)
 
+        self.worker_signals = WorkerSignals()
+        self.worker_signals.batch_done.connect(self.trash_batch_done)
+        self.worker_signals.empty_progress.connect(self.trash_empty_progress)
+        self.worker_signals.transcode_done.connect(self.transcode_done)
+        self.worker_signals.groups_ready.connect(self.set_groups)
+        self.worker_signals.album_stats_changed.connect(self.show_album_stats)
+        self.worker_signals.daemon_moved.connect(self.move_done)
+        self.worker_signals.daemon_trashed.connect(self.daemon_trash_done)
+        self.worker_signals.daemon_undone.connect(self.undo_done)
+        self.worker_signals.daemon_stats_ready.connect(self.set_daemon_stats)
+        # Daemon requests run one at a time, in order, off the GUI thread
+        self.daemon_requests = QThreadPool(self)
+        self.daemon_requests.setMaxThreadCount(1)
+        self.album_stats = None
+        self.daemon_stats = {}
+        if client is None:
+            self.album_stats = AlbumStats(
+                album_dir,
+                [a for a in album_lst if a != NO_ALBUM_BUTTON_TITLE],
+                on_change=self.worker_signals.album_stats_changed.emit,
+            )
+            for album in self.album_stats.albums:
+                self.show_album_stats(album)
+        else:
+            self.refresh_daemon_stats()
+        self.trash_worker = TrashWorker(
+            on_batch=self.worker_signals.batch_done.emit,
+            on_empty=self.worker_signals.empty_progress.emit,
+        )
+        self.transcoder = None
+        self.close_progress = None
+        if album_settings and client is None:
+            self.transcoder = TranscodePipeline(
+                {album_dir / name: s for name, s in album_settings.items()},
+                on_done=self.worker_signals.transcode_done.emit,
+            )
+
+        if group_gap > 0 and len(self.items) > 1:
+            items = list(self.items)
+            threading.Thread(
+                target=lambda: self.worker_signals.groups_ready.emit(
+                    group_items(items, group_gap)
+                ),
+                name="grouping",
+                daemon=True,
+            ).start()
+
+        file_menu = self.menuBar().addMenu("File")
+        empty_trash_action = file_menu.addAction("Empty Trash")
+        empty_trash_action.triggered.connect(self.empty_trash)
+        if client is not None:
+            edit_menu = self.menuBar().addMenu("Edit")
+            undo_action = edit_menu.addAction("Undo Move")
+            undo_action.setShortcut(QKeySequence.StandardKey.Undo)
+            undo_action.triggered.connect(self.undo_move)
+
+        self.setStatusBar(
+            StatusBar(["Memory"], font_size=FontSize.STATUS_BAR.value, skip_name=True)
+        )
         self.statusBar().addPermanentWidget(StatusWidget())
+        self.memory_timer = QTimer(self)
+        self.memory_timer.timeout.connect(self.show_memory_usage)
+        self.memory_timer.start(MEMORY_STATUS_TIMER)
+        self.governor.start_monitor()
         self.statusBar().showMessage("Ready", QUICK_MESSAGE_TIMER)
+        self.show_current_item()
         self.show()
 
+    def current_group(self) -> list:
+        if self.current_item >= len(self.items):
+            return []
+        head = self.items[self.current_item]
+        members = self.groups.get(head)
+        if members is None:
+            return [head]
+        end = self.current_item + 1
+        while end < len(self.items) and self.items[end] in members:
+            end += 1
+        return self.items[self.current_item : end]
+
+    def set_groups(self, groups: list) -> None:
+        # Map every frame, not just the first: the operator may have filed or
+        # skipped the start of a burst while grouping was still running
+        self.groups = {}
+        for group in groups:
+            if len(group) > 1:
+                members = set(group)
+                for item in group:
+                    self.groups[item] = members
+        self.show_current_item()
+
+    def show_current_item(self) -> None:
+        group = self.current_group()
+        if group:
+            item = group[0]
+            title = f"ImgSack - {item.name}"
+            if len(group) > 1:
+                title += f" (+{len(group) - 1} more in this burst)"
+            self.setWindowTitle(f"{title} ({self.current_item + 1}/{len(self.items)})")
+            self.image_label.set_item(item)
+            self.image_label.set_badge(
+                f"Burst of {len(group)}" if len(group) > 1 else ""
+            )
+            next_item = self.current_item + len(group)
+            if next_item < len(self.items):
+                self.image_label.prefetch(self.items[next_item])
+        elif self.items:
+            self.image_label.set_item(None)
+            self.image_label.set_badge("")
+            self.image_label.setText("No more items")
+            self.setWindowTitle("ImgSack")
+
+    def take_current_group(self) -> list:
+        group = self.current_group()
+        del self.items[self.current_item : self.current_item + len(group)]
+        self.show_current_item()
+        return group
+
+    def skip_item(self) -> None:
+        group = self.current_group()
+        if group:
+            self.current_item += len(group)
+            self.show_current_item()
+
+    def move_to_album(self, album: str) -> None:
+        group = self.take_current_group()
+        if not group:
+            return
+        if self.client is not None:
+            self.daemon_requests.start(lambda: self.daemon_move(group, album))
+            return
+        moved, failed = move_items(
+            group, self.album_dir / album, self.transcoder, self.album_stats
+        )
+        for item, destination in moved.items():
+            self.thumbnails.rekey(item, destination)
+        self.move_done(album, group, failed)
+
+    def move_done(self, album: str, group: list, failed: list) -> None:
+        if self.client is not None:
+            self.refresh_daemon_stats()
+        if failed:
+            self.items[self.current_item : self.current_item] = failed
+            self.show_current_item()
+            self.statusBar().showMessage(
+                f"Could not move {len(failed)} item(s) to {album}", MESSAGE_TIMER
+            )
+            return
+        name = group[0].name if len(group) == 1 else f"{len(group)} items"
+        self.statusBar().showMessage(f"{name} -> {album}", QUICK_MESSAGE_TIMER)
+
+    def daemon_move(self, group: list, album: str) -> None:
+        # Runs on self.daemon_requests
+        moves = [{"item": item.name, "album": album} for item in group]
+        try:
+            results = self.client.move(moves)
+        except (OSError, ValueError) as e:
+            logger.error(f"Daemon move to {album} failed: {e}")
+            failed = group
+        else:
+            errors = {r["item"] for r in results if "error" in r}
+            failed = [item for item in group if item.name in errors]
+        self.worker_signals.daemon_moved.emit(album, group, failed)
+
+    def daemon_preview(self, path: Path, size: int):
+        # Runs on the thread pool
+        try:
+            data = self.client.thumbnail(path.name, size)
+        except OSError as e:
+            logger.warning(f"No daemon thumbnail for {path.name}: {e}")
+            return None
+        image = QImage.fromData(data, "PNG")
+        return None if image.isNull() else image
+
+    def undo_move(self) -> None:
+        def undo():
+            try:
+                restored = self.client.undo()
+            except (OSError, ValueError) as e:
+                restored = e
+            self.worker_signals.daemon_undone.emit(restored)
+
+        self.daemon_requests.start(undo)
+
+    def undo_done(self, restored) -> None:
+        if isinstance(restored, Exception):
+            self.statusBar().showMessage(f"Undo failed: {restored}", MESSAGE_TIMER)
+            return
+        if not restored:
+            self.statusBar().showMessage("Nothing to undo", QUICK_MESSAGE_TIMER)
+            return
+        items = sorted(self.source_dir / name for name in restored)
+        self.items[self.current_item : self.current_item] = items
+        self.refresh_daemon_stats()
+        self.show_current_item()
+        self.statusBar().showMessage(
+            f"Restored {len(items)} item(s)", QUICK_MESSAGE_TIMER
+        )
+
+    def refresh_daemon_stats(self) -> None:
+        def fetch():
+            try:
+                stats = self.client.album_stats()
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not fetch album stats from the daemon: {e}")
+                return
+            self.worker_signals.daemon_stats_ready.emit(stats)
+
+        self.daemon_requests.start(fetch)
+
+    def set_daemon_stats(self, stats: dict) -> None:
+        self.daemon_stats = stats
+        for album in self.daemon_stats:
+            self.show_album_stats(album)
+
+    def show_album_stats(self, album: str) -> None:
+        if self.album_stats is not None:
+            stats = self.album_stats.get(album)
+        else:
+            stats = self.daemon_stats.get(album)
+        for labels in self.label_sets:
+            labels.set_album_stats(album, stats)
+
+    def transcode_done(self, result) -> None:
+        if result.error is not None:
+            message = f"Transcode of {result.source.name} failed: {result.error}"
+        else:
+            saved = result.bytes_in - result.bytes_out
+            self.album_stats.record_resize(result.output, -saved, result.dir_mtime)
+            if result.output != result.source:
+                self.thumbnails.rekey(result.source, result.output)
+            message = f"{result.output.name}: {format_bytes(saved)} saved"
+        self.statusBar().showMessage(message, QUICK_MESSAGE_TIMER)
+        if self.close_progress is not None:
+            pending = self.transcoder.pending()
+            self.close_progress.setValue(self.close_progress.maximum() - pending)
+            if pending == 0:
+                self.close()
+
+    def finish_transcodes(self) -> None:
+        if self.close_progress is not None:
+            return
+        pending = self.transcoder.pending()
+        self.close_progress = QProgressDialog(
+            f"Finishing {pending} transcode(s)...", "Quit Now", 0, pending, self
+        )
+        self.close_progress.setWindowTitle("ImgSack")
+        self.close_progress.setWindowModality(Qt.WindowModality.WindowModal)
+        self.close_progress.setMinimumDuration(0)
+        self.close_progress.canceled.connect(self.cancel_transcodes)
+        self.close_progress.setValue(0)
+
+    def cancel_transcodes(self) -> None:
+        # Items not yet started keep their original file
+        self.transcoder.shutdown(cancel=True)
+        self.transcoder = None
+        self.close()
+
+    def trash_item(self) -> None:
+        group = self.take_current_group()
+        if self.client is None:
+            for item in group:
+                self.trash_worker.submit(item)
+            return
+        if group:
+            self.daemon_requests.start(lambda: self.daemon_trash(group))
+
+    def daemon_trash(self, group: list) -> None:
+        # Runs on self.daemon_requests
+        try:
+            results = self.client.trash([item.name for item in group])
+        except (OSError, ValueError) as e:
+            logger.error(f"Daemon trash failed: {e}")
+            results = [{"item": item.name, "size": 0, "error": e} for item in group]
+        self.worker_signals.daemon_trashed.emit(
+            [
+                TrashResult(
+                    self.source_dir / r["item"], None, r["size"], r.get("error")
+                )
+                for r in results
+            ]
+        )
+
+    def daemon_trash_done(self, results: list) -> None:
+        self.trash_batch_done(results)
+        failed = [r.source for r in results if r.error is not None]
+        if failed:
+            self.items[self.current_item : self.current_item] = failed
+            self.show_current_item()
+
+    def trash_batch_done(self, results: list) -> None:
+        trashed = [r for r in results if r.error is None]
+        failed = len(results) - len(trashed)
+        if self.album_stats is not None:
+            for result in trashed:
+                self.album_stats.record_remove(result.source, result.size)
+        message = (
+            f"Trashed {len(trashed)} item(s), "
+            f"{format_bytes(sum(r.size for r in trashed))} to be reclaimed"
+        )
+        if failed:
+            message += f" - {failed} failed"
+        self.statusBar().showMessage(message, MESSAGE_TIMER)
+
+    def empty_trash(self) -> None:
+        answer = QMessageBox.question(
+            self,
+            "Empty Trash",
+            "Permanently delete all items in the trash?",
+        )
+        if answer == QMessageBox.StandardButton.Yes:
+            self.statusBar().showMessage("Emptying trash...")
+            self.trash_worker.empty()
+
+    def trash_empty_progress(self, progress) -> None:
+        message = (
+            f"{progress.items} item(s), {format_bytes(progress.freed)} reclaimed"
+        )
+        if progress.done:
+            self.statusBar().showMessage(f"Trash emptied: {message}", MESSAGE_TIMER)
+        else:
+            self.statusBar().showMessage(f"Emptying trash: {message}")
+
+    def show_memory_usage(self) -> None:
+        usage = ", ".join(
+            f"{name} {format_bytes(used)}"
+            for name, used in self.governor.usage().items()
+        )
+        budget = format_bytes(self.governor.effective_budget)
+        if self.governor.under_pressure:
+            budget += " (pressure)"
+        self.statusBar().setArea("Memory", f"{usage} / {budget}")
+
+    def closeEvent(self, event: QCloseEvent) -> None:
+        if self.transcoder is not None and self.transcoder.pending():
+            # The pool keeps working; transcode_done closes again when it is done
+            event.ignore()
+            self.finish_transcodes()
+            return
+        self.governor.stop_monitor()
+        if self.album_stats is not None:
+            self.album_stats.save()
+        self.trash_worker.stop()
+        # Requests time out, so this cannot hang on a dead daemon
+        self.daemon_requests.waitForDone()
+        if self.transcoder is not None:
+            self.transcoder.shutdown()
+        if self.thumbnails is not None:
+            # Queued previews and re-keys are lost otherwise
+            self.thumbnails.flush()
+        super().closeEvent(event)
+
     def keyPressEvent(self, event: QKeyEvent) -> QKeyEvent:
         super().keyPressEvent(event)
         if event.key() in KEYPRESS_VALUES:
@@ -228,12 +630,63 @@ if __name__ == "__main__":
     parser.add_argument(
         "-e",
         "--extensions",
-        help="list of image extensions",
+        help="image extensions to queue, e.g. -e .jpg .png",
+        nargs="+",
         default=DEFAULT_EXTENSIONS,
     )
+    parser.add_argument(
+        "-d",
+        "--daemon",
+        help="URL of a running imsd sorting daemon to use instead of scanning",
+        default=None,
+    )
+    parser.add_argument(
+        "-g",
+        "--group-gap",
+        help="seconds between frames grouped as one burst (0 disables grouping)",
+        type=float,
+        default=DEFAULT_GROUP_GAP,
+    )
+    parser.add_argument(
+        "-m",
+        "--memory-budget",
+        help="memory budget for all caches, e.g. 512M or 2G",
+        default=None,
+    )
+    parser.add_argument(
+        "--profile",
+        help="write sampling profile and span trace, transcode workers included, "
+        "to this directory on exit",
+        nargs="?",
+        const="imgsack-profile",
+        default=None,
+    )
     args = parser.parse_args()
 
-    if args.config is not None:
+    if args.profile is not None:
+        profiler.start(Path(args.profile).expanduser().resolve())
+
+    album_list = None
+    album_settings = {}
+    client = None
+    memory_budget = DEFAULT_MEMORY_BUDGET
+    extensions = args.extensions
+
+    if args.daemon is not None:
+        from imsd import ImgSackClient
+
+        client = ImgSackClient(args.daemon)
+        try:
+            status = client.status()
+            source_directory = Path(status["source_directory"])
+            album_directory = Path(status["album_directory"])
+            album_list = client.albums()
+            item_list = [source_directory / name for name in client.all_items()]
+        except (OSError, ValueError) as e:
+            logging.critical(f"Cannot reach the daemon at {args.daemon}: {e}")
+            exit(1)
+        logger.info(f"{len(item_list)} items queued by daemon {args.daemon}")
+    elif args.config is not None:
         config_file = Path(args.config).expanduser().resolve()
         if not config_file.exists():
             logging.critical(f"Configuration file {args.config} does not exist")
@@ -241,9 +694,20 @@ if __name__ == "__main__":
         config = json.loads(config_file.read_text())
         source_directory = Path(config["source_directory"]).expanduser().resolve()
         album_directory = Path(config["output_directory"]).expanduser().resolve()
-        albums = config["albums"]
-        logging.critical("Config - Not implemented yet")
-        exit(1)
+        extensions = config.get("extensions", DEFAULT_EXTENSIONS)
+        memory_budget = config.get("memory_budget", memory_budget)
+        if not source_directory.exists():
+            logging.critical(f"Source directory {source_directory} does not exist")
+            exit(1)
+        album_list = []
+        for album in config["albums"]:
+            name = album["directory"].strip("/")
+            if not is_album(album_directory / name):
+                logging.warning(f"Album {album_directory / name} does not exist")
+                name = NO_ALBUM_BUTTON_TITLE
+            elif "transcode" in album:
+                album_settings[name] = settings_from_config(album["transcode"])
+            album_list.append(name)
     else:
         source_directory = Path(args.source).expanduser().resolve()
         logger.debug(f"Source Directory: {source_directory}")
@@ -260,40 +724,67 @@ if __name__ == "__main__":
                 logging.critical(f"Album directory {args.albums} does not exist")
                 exit(1)
 
-    album_list = []
-    for d in album_directory.iterdir():
-        logger.debug(f"{d} is_album: {is_album(d)} is_not_dotted: {is_not_dotted(d)}")
-        if is_album(d) and is_not_dotted(d):
-            album_list.append(d.name)
-
-    album_list.sort()
-
-    if len(album_list) < 1:
-        logging.critical(f"Album directory {album_directory} has no albums")
+    if args.daemon is None:
+        if album_list is None:
+            with span("album discovery"):
+                album_list = []
+                for d in album_directory.iterdir():
+                    logger.debug(
+                        f"{d} is_album: {is_album(d)} is_not_dotted: {is_not_dotted(d)}"
+                    )
+                    if is_album(d) and is_not_dotted(d):
+                        album_list.append(d.name)
+
+                album_list.sort()
+
+        if len(album_list) < 1:
+            logging.critical(f"Album directory {album_directory} has no albums")
+            exit(1)
+        if len(album_list) < MIN_ALBUMS:
+            logging.info(
+                f"Album directory {album_directory} has {len(album_list)} albums - padding to {MIN_ALBUMS}"
+            )
+            album_list = album_list + [NO_ALBUM_BUTTON_TITLE] * (
+                MAX_ALBUMS - len(album_list)
+            )
+        if len(album_list) > MAX_ALBUMS:
+            logging.warning(
+                f"Album directory {album_directory} has too many albums - truncating to {MAX_ALBUMS}"
+            )
+            album_list = album_list[:MAX_ALBUMS]
+
+        with span("scan"):
+            extensions = image_extensions(extensions)
+            item_list = [
+                f
+                for f in source_directory.iterdir()
+                if f.suffix.lower() in extensions and f.is_file()
+            ]
+            item_list.sort()
+        logger.info(f"{len(item_list)} items found in {source_directory}")
+
+    if args.memory_budget is not None:
+        memory_budget = args.memory_budget
+    try:
+        governor = MemoryGovernor(parse_size(memory_budget))
+    except ValueError as e:
+        logging.critical(f"Memory budget: {e}")
         exit(1)
-    if len(album_list) < MIN_ALBUMS:
-        logging.info(
-            f"Album directory {album_directory} has {len(album_list)} albums - padding to {MIN_ALBUMS}"
-        )
-        album_list = album_list + [NO_ALBUM_BUTTON_TITLE] * (
-            MAX_ALBUMS - len(album_list)
-        )
-    if len(album_list) > MAX_ALBUMS:
-        logging.warning(
-            f"Album directory {album_directory} has too many albums - truncating to {MAX_ALBUMS}"
-        )
-        album_list = album_list[:MAX_ALBUMS]
-
-    item_list = [
-        Path(f).expanduser()
-        for f in source_directory.iterdir()
-        if Path(f).expanduser().suffix in DEFAULT_EXTENSIONS
-    ]
-    logger.info(f"{len(item_list)} items found in {source_directory}")
 
     app = QApplication([])
 
-    window = MainWindow(source_directory, album_directory, album_list)
-    window.show()
+    with span("ui build"):
+        window = MainWindow(
+            source_directory,
+            album_directory,
+            album_list,
+            item_list,
+            album_settings,
+            args.group_gap,
+            governor,
+            client,
+        )
+        window.show()
 
     app.exec()
+    profiler.stop()
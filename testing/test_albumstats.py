@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+pytest.importorskip("rich")
+
+from albumstats import AlbumStats, walk_album
+
+
+def make_album(tmp_path):
+    album = tmp_path / "Holiday"
+    (album / "day1").mkdir(parents=True)
+    (album / "a.jpg").write_bytes(b"a" * 10)
+    (album / "day1" / "b.jpg").write_bytes(b"b" * 20)
+    (album / ".hidden").write_bytes(b"h" * 40)
+    return album
+
+
+def test_walk_album_recurses_and_records_every_directory(tmp_path):
+    album = make_album(tmp_path)
+    stats = walk_album(album)
+    assert (stats["count"], stats["bytes"]) == (2, 30)
+    assert set(stats["dirs"]) == {".", "day1"}
+    assert stats["dirs"]["day1"] == (album / "day1").stat().st_mtime_ns
+
+
+def test_refresh_rewalks_when_a_subfolder_changes(tmp_path):
+    album = make_album(tmp_path)
+    stats = AlbumStats(tmp_path, ["Holiday"])
+    stats.refresh()
+    assert stats.get("Holiday")["count"] == 2
+    assert "dirs" not in stats.get("Holiday")
+
+    # Only the subfolder's mtime changes, not the album's own
+    top = album.stat().st_mtime_ns
+    (album / "day1" / "c.jpg").write_bytes(b"c" * 5)
+    os.utime(album / "day1", ns=(top + 10**9, top + 10**9))
+    assert album.stat().st_mtime_ns == top
+    stats.refresh()
+    assert stats.get("Holiday")["count"] == 3
+    assert stats.get("Holiday")["bytes"] == 35
+
+
+def bump_mtime(directory, seconds):
+    later = directory.stat().st_mtime_ns + seconds * 10**9
+    os.utime(directory, ns=(later, later))
+
+
+def test_own_change_keeps_the_album_walked(tmp_path):
+    album = make_album(tmp_path)
+    stats = AlbumStats(tmp_path, ["Holiday"])
+    stats.refresh()
+
+    dir_mtime = album.stat().st_mtime_ns
+    (album / "c.jpg").write_bytes(b"c" * 5)
+    bump_mtime(album, 1)
+    stats.record_add(album / "c.jpg", dir_mtime)
+    assert stats._stats["Holiday"]["dirs"]["."] == album.stat().st_mtime_ns
+    assert stats.get("Holiday")["count"] == 3
+
+
+def test_foreign_change_before_own_change_rewalks(tmp_path):
+    album = make_album(tmp_path)
+    stats = AlbumStats(tmp_path, ["Holiday"])
+    stats.refresh()
+
+    # Someone else adds a file, then ImgSack moves one in
+    (album / "x.jpg").write_bytes(b"x" * 7)
+    bump_mtime(album, 1)
+    dir_mtime = album.stat().st_mtime_ns
+    (album / "c.jpg").write_bytes(b"c" * 5)
+    bump_mtime(album, 1)
+    stats.record_add(album / "c.jpg", dir_mtime)
+    assert "dirs" not in stats._stats["Holiday"]
+
+    stats.refresh()
+    assert stats.get("Holiday")["count"] == 4
+    assert stats.get("Holiday")["bytes"] == 42
@@ -0,0 +1,85 @@
+import os
+import struct
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("rich")
+
+from grouping import exif_capture_time, group_items
+
+
+def ifd(endian: str, entries: list, offset: int, trailer: bytes = b"") -> bytes:
+    """
+    An IFD at `offset` with (tag, type, count, value bytes) entries; values
+    longer than four bytes go into the data area right after it.
+    """
+    data_offset = offset + 2 + len(entries) * 12 + 4
+    body, data = b"", b""
+    for tag, kind, value in entries:
+        if len(value) > 4:
+            inline = struct.pack(f"{endian}I", data_offset + len(data))
+            data += value
+        else:
+            inline = value.ljust(4, b"\0")
+        body += struct.pack(f"{endian}HHI", tag, kind, len(value)) + inline
+    return struct.pack(f"{endian}H", len(entries)) + body + b"\0\0\0\0" + data
+
+
+def jpeg_with_exif(endian: str, stamp: bytes, subsec: bytes = None) -> bytes:
+    header = (b"II*\0" if endian == "<" else b"MM\0*") + struct.pack(f"{endian}I", 8)
+    ifd0 = ifd(endian, [(0x8769, 4, b"\0\0\0\0")], 8)
+    exif_offset = 8 + len(ifd0)
+    ifd0 = ifd(endian, [(0x8769, 4, struct.pack(f"{endian}I", exif_offset))], 8)
+    entries = [(0x9003, 2, stamp + b"\0")]
+    if subsec is not None:
+        entries.append((0x9291, 2, subsec + b"\0"))
+    tiff = header + ifd0 + ifd(endian, entries, exif_offset)
+    app1 = b"Exif\0\0" + tiff
+    return (
+        b"\xff\xd8"
+        + b"\xff\xe0"
+        + struct.pack(">H", 16)
+        + b"JFIF\0" + b"\0" * 9
+        + b"\xff\xe1"
+        + struct.pack(">H", len(app1) + 2)
+        + app1
+        + b"\xff\xda\0\x02"
+    )
+
+
+@pytest.mark.parametrize("endian", ["<", ">"])
+def test_exif_capture_time_with_subseconds(tmp_path, endian):
+    p = tmp_path / "burst.jpg"
+    p.write_bytes(jpeg_with_exif(endian, b"2024:05:06 07:08:09", b"25"))
+    expected = datetime(2024, 5, 6, 7, 8, 9).timestamp() + 0.25
+    assert exif_capture_time(p) == pytest.approx(expected)
+
+
+def test_exif_capture_time_without_subseconds(tmp_path):
+    p = tmp_path / "single.jpg"
+    p.write_bytes(jpeg_with_exif("<", b"2024:05:06 07:08:09"))
+    assert exif_capture_time(p) == datetime(2024, 5, 6, 7, 8, 9).timestamp()
+
+
+def test_exif_capture_time_missing_or_broken(tmp_path):
+    p = tmp_path / "plain.jpg"
+    p.write_bytes(b"\xff\xd8\xff\xda\0\x02")
+    assert exif_capture_time(p) is None
+    p.write_bytes(b"\x89PNG\r\n\x1a\n")
+    assert exif_capture_time(p) is None
+    p.write_bytes(jpeg_with_exif(">", b"not a date at all!!")[:60])
+    assert exif_capture_time(p) is None
+    p.write_bytes(jpeg_with_exif(">", b"2024:13:45 99:99:99"))
+    assert exif_capture_time(p) is None
+
+
+def test_group_items_survives_a_vanished_file(tmp_path):
+    items = []
+    for i in range(3):
+        p = tmp_path / f"{i}.png"
+        p.write_bytes(b"not decoded")
+        os.utime(p, (1000 + i * 60, 1000 + i * 60))
+        items.append(p)
+    items[1].unlink()
+    assert group_items(items) == [[items[0]], [items[1]], [items[2]]]
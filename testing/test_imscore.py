@@ -0,0 +1,45 @@
+import pytest
+
+pytest.importorskip("rich")
+
+from imscore import image_extensions, move_item, move_items
+
+
+def test_image_extensions_from_list():
+    assert image_extensions([".jpg", "PNG", ".JPEG"]) == {".jpg", ".png", ".jpeg"}
+
+
+def test_image_extensions_from_string():
+    # A plain string must not turn into a substring test
+    extensions = image_extensions(".jpg, .png")
+    assert extensions == {".jpg", ".png"}
+    assert "" not in extensions
+    assert ".j" not in extensions
+
+
+def test_image_extensions_skips_empty_entries():
+    assert image_extensions(["", ".", ".gif"]) == {".gif"}
+
+
+def test_move_item_never_replaces(tmp_path):
+    album = tmp_path / "album"
+    album.mkdir()
+    (album / "IMG_0001.jpg").write_bytes(b"archived")
+    source = tmp_path / "IMG_0001.jpg"
+    source.write_bytes(b"new")
+    destination = move_item(source, album)
+    assert destination == album / "IMG_0001.2.jpg"
+    assert destination.read_bytes() == b"new"
+    assert (album / "IMG_0001.jpg").read_bytes() == b"archived"
+    assert not source.exists()
+
+
+def test_move_items_reports_moved_and_failed(tmp_path):
+    album = tmp_path / "album"
+    album.mkdir()
+    present = tmp_path / "a.jpg"
+    present.write_bytes(b"a")
+    missing = tmp_path / "b.jpg"
+    moved, failed = move_items([present, missing], album)
+    assert moved == {present: album / "a.jpg"}
+    assert failed == [missing]
@@ -0,0 +1,119 @@
+import json
+import threading
+from http.client import HTTPConnection
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("rich")
+pytest.importorskip("PySide6")
+
+from imsd import ServiceRequestHandler, SortingService, ThumbnailCache
+from memory import MemoryGovernor
+from thumbcache import ThumbnailStore
+from transcode import TranscodeResult
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path / "data"))
+    source = tmp_path / "inbox"
+    albums = tmp_path / "albums"
+    source.mkdir()
+    (albums / "Screenshots").mkdir(parents=True)
+    for name in ("a.png", "b.png"):
+        (source / name).write_bytes(b"png")
+    store = ThumbnailStore(root=tmp_path / "thumbnails")
+    return SortingService(source, albums, [".png"], store=store)
+
+
+def test_undo_restores_the_transcoded_file(service):
+    service.move([{"item": "a.png", "album": "Screenshots"}])
+    moved = service.album_directory / "Screenshots" / "a.png"
+    output = moved.with_suffix(".webp")
+    moved.rename(output)
+    service._transcoded(TranscodeResult(moved, output, 3, 3, None))
+
+    assert service.undo() == ["a.webp"]
+    assert (service.source_directory / "a.webp").exists()
+    assert "a.webp" in service.items
+
+
+def test_failed_undo_stays_in_the_journal(service):
+    service.move([{"item": "a.png", "album": "Screenshots"}])
+    moved = service.album_directory / "Screenshots" / "a.png"
+    hidden = moved.with_name("elsewhere.png")
+    moved.rename(hidden)
+
+    assert service.undo() == []
+    hidden.rename(moved)
+    assert service.undo() == ["a.png"]
+    assert service.items == ["a.png", "b.png"]
+
+
+@pytest.mark.parametrize(
+    "moves",
+    [
+        [{"item": "a.png", "album": "Screenshots"}, {"item": None, "album": "x"}],
+        [{"item": "a.png", "album": "Screenshots"}, "b.png"],
+        {"item": "a.png", "album": "Screenshots"},
+    ],
+)
+def test_malformed_move_moves_nothing(service, moves):
+    with pytest.raises(ValueError):
+        service.move(moves)
+    assert (service.source_directory / "a.png").exists()
+    assert service.items == ["a.png", "b.png"]
+
+
+@pytest.fixture
+def server(service, monkeypatch):
+    monkeypatch.setattr(ServiceRequestHandler, "service", service)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ServiceRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def request(server, method, path, body=None, **headers):
+    connection = HTTPConnection(*server.server_address)
+    connection.request(method, path, body, headers)
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    return response.status
+
+
+def test_api_takes_json_from_local_clients(server):
+    body = json.dumps({"moves": [{"item": "a.png", "album": "Screenshots"}]})
+    assert request(server, "GET", "/status") == 200
+    status = request(
+        server, "POST", "/move", body, **{"Content-Type": "application/json"}
+    )
+    assert status == 200
+
+
+def test_api_refuses_cross_site_requests(server, service):
+    body = json.dumps({"moves": [{"item": "a.png", "album": "Screenshots"}]})
+    json_type = {"Content-Type": "application/json"}
+    text_type = {"Content-Type": "text/plain"}
+    # A form or no-cors fetch can only send "simple" content types
+    assert request(server, "POST", "/move", body, **text_type) == 415
+    # DNS rebinding keeps the attacker's host name
+    assert request(server, "GET", "/status", Host="evil.example:8734") == 403
+    # A page on another origin
+    origin = {"Origin": "http://evil.example", **json_type}
+    assert request(server, "POST", "/move", body, **origin) == 403
+    assert service.items == ["a.png", "b.png"]
+
+
+def test_thumbnail_cache_is_bounded_by_the_governor_budget():
+    governor = MemoryGovernor(budget=250)
+    cache = ThumbnailCache()
+    governor.register(cache)
+    for i in range(5):
+        cache.put(("item", i), b"t" * 100)
+    assert cache.current_bytes == 200
+    assert cache.get(("item", 4)) is not None
+    assert cache.get(("item", 0)) is None
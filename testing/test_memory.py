@@ -0,0 +1,77 @@
+import pytest
+
+pytest.importorskip("rich")
+
+import memory
+from memory import cgroup_memory_limit, memory_pressure, parse_size
+
+
+@pytest.mark.parametrize(
+    "size, expected",
+    [
+        (1073741824, 1073741824),
+        ("1073741824", 1073741824),
+        ("512K", 512 * 1024),
+        ("1024M", 1024**3),
+        ("1G", 1024**3),
+        ("1.5G", 3 * 1024**3 // 2),
+        ("2 GiB", 2 * 1024**3),
+        ("1gb", 1024**3),
+        (" 3T ", 3 * 1024**4),
+    ],
+)
+def test_parse_size(size, expected):
+    assert parse_size(size) == expected
+
+
+@pytest.mark.parametrize("size", ["", "G", "-1G", "1X", "one gig", "1..5M"])
+def test_parse_size_rejects(size):
+    with pytest.raises(ValueError):
+        parse_size(size)
+
+
+@pytest.fixture
+def cgroup(tmp_path, monkeypatch):
+    monkeypatch.setattr(memory, "_CGROUP_ROOT", tmp_path / "cgroup")
+    monkeypatch.setattr(memory, "_PROC_CGROUP", tmp_path / "self-cgroup")
+    monkeypatch.setattr(memory, "_SYSTEM_PRESSURE", tmp_path / "no-pressure")
+    return tmp_path
+
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+def test_cgroup_v2_uses_own_cgroup_and_tightest_ancestor(cgroup):
+    write(cgroup / "self-cgroup", "0::/user.slice/app.scope\n")
+    root = cgroup / "cgroup"
+    write(root / "memory.max", "max\n")
+    write(root / "user.slice" / "memory.max", "2147483648\n")
+    write(root / "user.slice" / "app.scope" / "memory.max", "max\n")
+    write(
+        root / "user.slice" / "app.scope" / "memory.pressure",
+        "some avg10=12.50 avg60=1.00 avg300=0.00 total=1\n"
+        "full avg10=0.00 avg60=0.00 avg300=0.00 total=0\n",
+    )
+    assert cgroup_memory_limit() == 2147483648
+    assert memory_pressure() == 12.5
+
+
+def test_cgroup_v1_memory_controller(cgroup):
+    write(cgroup / "self-cgroup", "5:cpu,cpuacct:/\n4:memory:/docker/abc\n0::/\n")
+    write(
+        cgroup / "cgroup" / "memory" / "docker" / "abc" / "memory.limit_in_bytes",
+        "536870912\n",
+    )
+    write(
+        cgroup / "cgroup" / "memory" / "memory.limit_in_bytes",
+        "9223372036854771712\n",
+    )
+    assert cgroup_memory_limit() == 536870912
+    assert memory_pressure() is None
+
+
+def test_no_cgroup(cgroup):
+    assert cgroup_memory_limit() is None
+    assert memory_pressure() is None
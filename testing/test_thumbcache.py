@@ -0,0 +1,138 @@
+import json
+import os
+import struct
+import zlib
+
+import pytest
+
+pytest.importorskip("rich")
+
+from thumbcache import (
+    ThumbnailStore,
+    _chunk,
+    _chunks,
+    png_text,
+    set_png_text,
+    tier_for,
+)
+
+SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def tiny_png(*extra_chunks) -> bytes:
+    ihdr = _chunk(b"IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 0, 0, 0, 0))
+    idat = _chunk(b"IDAT", zlib.compress(b"\0\0"))
+    return SIGNATURE + ihdr + b"".join(extra_chunks) + idat + _chunk(b"IEND", b"")
+
+
+def chunk_kinds(png: bytes) -> list:
+    return [kind for kind, _data, _raw in _chunks(png)]
+
+
+def test_png_text_reads_all_text_chunk_kinds():
+    png = tiny_png(
+        _chunk(b"tEXt", b"Thumb::MTime\x001714979289"),
+        _chunk(b"zTXt", b"Software\x00\x00" + zlib.compress(b"ImgSack")),
+        _chunk(b"iTXt", b"Thumb::URI\x00\x00\x00\x00\x00file:///a%20b.jpg"),
+    )
+    assert png_text(png) == {
+        "Thumb::MTime": "1714979289",
+        "Software": "ImgSack",
+        "Thumb::URI": "file:///a%20b.jpg",
+    }
+
+
+def test_png_text_ignores_non_png():
+    assert png_text(b"GIF89a") == {}
+
+
+def test_set_png_text_replaces_only_given_keys():
+    png = tiny_png(
+        _chunk(b"tEXt", b"Thumb::URI\x00file:///old.jpg"),
+        _chunk(b"tEXt", b"Thumb::MTime\x0042"),
+    )
+    rewritten = set_png_text(png, {"Thumb::URI": "file:///new.jpg"})
+    assert png_text(rewritten) == {
+        "Thumb::URI": "file:///new.jpg",
+        "Thumb::MTime": "42",
+    }
+    # New text goes right after IHDR and the image data is copied unchanged
+    assert chunk_kinds(rewritten)[:2] == [b"IHDR", b"tEXt"]
+    assert chunk_kinds(rewritten).count(b"tEXt") == 2
+    idat = [raw for kind, _data, raw in _chunks(png) if kind == b"IDAT"]
+    assert idat == [raw for kind, _data, raw in _chunks(rewritten) if kind == b"IDAT"]
+
+
+def test_set_png_text_writes_valid_crcs():
+    rewritten = set_png_text(tiny_png(), {"Thumb::Size": "1234"})
+    for kind, data, raw in _chunks(rewritten):
+        assert struct.unpack(">I", raw[-4:])[0] == zlib.crc32(kind + data)
+
+
+def test_tier_for_rounds_up():
+    assert tier_for(1) == 64
+    assert tier_for(128) == 128
+    assert tier_for(129) == 256
+    assert tier_for(4096) == 1024
+
+
+def test_has_checks_existence_and_age(tmp_path):
+    source = tmp_path / "a.jpg"
+    source.write_bytes(b"jpeg")
+    store = ThumbnailStore(root=tmp_path / "thumbnails")
+    assert not store.has(source, 256)
+    store.store(source, 256, tiny_png())
+    store.flush()
+    assert store.has(source, 256)
+    assert not store.has(source, 128)
+    later = store.path_for(source, 256).stat().st_mtime + 10
+    os.utime(source, (later, later))
+    assert not store.has(source, 256)
+
+
+def test_trim_only_touches_own_thumbnails(tmp_path):
+    root = tmp_path / "thumbnails"
+    foreign = root / "large" / "0123456789abcdef0123456789abcdef.png"
+    foreign.parent.mkdir(parents=True)
+    foreign.write_bytes(b"x" * 10_000)
+    store = ThumbnailStore(root=root, max_bytes=250)
+    sources = []
+    for i in range(3):
+        source = tmp_path / f"{i}.jpg"
+        source.write_bytes(b"jpeg")
+        sources.append(source)
+        store.store(source, 256, b"t" * 100)
+        store.flush()
+        thumbnail = store.path_for(source, 256)
+        os.utime(thumbnail, (1000 + i, 1000 + i))
+    store.store(tmp_path / "3.jpg", 256, b"t" * 100)
+    store.flush()
+
+    assert foreign.read_bytes() == b"x" * 10_000
+    kept = [s.name for s in sources if store.path_for(s, 256).exists()]
+    # Oldest first, down to 90% of 250 bytes
+    assert kept == ["2.jpg"]
+    assert store.path_for(tmp_path / "3.jpg", 256).exists()
+    index = (root / ".imgsack-index.json").read_text()
+    assert "large/" in index and "0123456789abcdef" not in index
+
+
+def test_rekey_keeps_ownership(tmp_path):
+    root = tmp_path / "thumbnails"
+    store = ThumbnailStore(root=root)
+    ours, theirs = tmp_path / "ours.jpg", tmp_path / "theirs.jpg"
+    store.store(ours, 256, tiny_png())
+    foreign = store.path_for(theirs, 256)
+    foreign.parent.mkdir(parents=True, exist_ok=True)
+    foreign.write_bytes(tiny_png())
+    store.flush()
+
+    store.rekey(ours, tmp_path / "album" / "ours.jpg")
+    store.rekey(theirs, tmp_path / "album" / "theirs.jpg")
+    store.flush()
+
+    moved_ours = store.path_for(tmp_path / "album" / "ours.jpg", 256)
+    moved_theirs = store.path_for(tmp_path / "album" / "theirs.jpg", 256)
+    assert moved_ours.exists() and moved_theirs.exists()
+    index = json.loads((root / ".imgsack-index.json").read_text())
+    assert list(index) == [str(moved_ours.relative_to(root))]
@@ -0,0 +1,81 @@
+import pytest
+
+pytest.importorskip("rich")
+QtGui = pytest.importorskip("PySide6.QtGui")
+
+import transcode
+from transcode import (
+    TEMP_PREFIX,
+    TranscodePipeline,
+    TranscodeSettings,
+    transcode_file,
+)
+
+JPEG = TranscodeSettings("jpeg", 80, True)
+
+
+def make_png(path, alpha=False):
+    image_format = QtGui.QImage.Format_ARGB32 if alpha else QtGui.QImage.Format_RGB32
+    image = QtGui.QImage(16, 12, image_format)
+    image.fill(QtGui.QColor(255, 0, 0, 128 if alpha else 255))
+    assert image.save(str(path), "PNG")
+    return path
+
+
+def leftovers(directory):
+    return [p.name for p in directory.iterdir() if p.name.startswith(TEMP_PREFIX)]
+
+
+def test_transcode_replaces_the_original(tmp_path):
+    source = make_png(tmp_path / "a.png")
+    result = transcode_file(str(source), JPEG)
+    assert result.error is None
+    assert result.output == tmp_path / "a.jpg"
+    assert result.bytes_out == result.output.stat().st_size
+    assert not source.exists()
+    written = QtGui.QImage(str(result.output))
+    assert (written.width(), written.height()) == (16, 12)
+    assert leftovers(tmp_path) == []
+
+
+def test_failed_verification_keeps_the_original(tmp_path, monkeypatch):
+    class ShrinkingReader(QtGui.QImageReader):
+        # Reads of the new file report the wrong size
+        def size(self):
+            size = super().size()
+            if TEMP_PREFIX in self.fileName():
+                size.setWidth(size.width() - 1)
+            return size
+
+    monkeypatch.setattr(QtGui, "QImageReader", ShrinkingReader)
+    source = make_png(tmp_path / "a.png")
+    data = source.read_bytes()
+    result = transcode_file(str(source), JPEG)
+    assert result.output is None
+    assert "Verification" in result.error
+    assert source.read_bytes() == data
+    assert not (tmp_path / "a.jpg").exists()
+    assert leftovers(tmp_path) == []
+
+
+def test_alpha_is_not_flattened_into_jpeg(tmp_path):
+    source = make_png(tmp_path / "a.png", alpha=True)
+    data = source.read_bytes()
+    result = transcode_file(str(source), JPEG)
+    assert "left as is" in result.error
+    assert source.read_bytes() == data
+    assert [p.name for p in tmp_path.iterdir()] == ["a.png"]
+
+
+def test_full_backlog_reports_the_item(tmp_path, monkeypatch):
+    monkeypatch.setattr(transcode, "TRANSCODE_BACKLOG", 0)
+    source = make_png(tmp_path / "a.png")
+    results = []
+    pipeline = TranscodePipeline({tmp_path: JPEG}, workers=1, on_done=results.append)
+    try:
+        assert not pipeline.submit(source)
+    finally:
+        pipeline.shutdown(cancel=True)
+    assert [(r.source, r.output) for r in results] == [(source, None)]
+    assert "backlog full" in results[0].error
+    assert source.exists()
@@ -0,0 +1,80 @@
+from pathlib import Path
+from urllib.parse import unquote
+
+import pytest
+
+pytest.importorskip("rich")
+
+from trash import Trash, mount_points
+
+
+@pytest.fixture
+def trash(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path / "data"))
+    return Trash()
+
+
+def make_item(directory: Path, name: str, data: bytes = b"data") -> Path:
+    directory.mkdir(parents=True, exist_ok=True)
+    item = directory / name
+    item.write_bytes(data)
+    return item
+
+
+def trashinfo(trash_dir: Path, name: str) -> dict:
+    lines = (trash_dir / "info" / f"{name}.trashinfo").read_text().splitlines()
+    assert lines[0] == "[Trash Info]"
+    return dict(line.split("=", 1) for line in lines[1:])
+
+
+def test_trash_writes_trashinfo(trash, tmp_path):
+    item = make_item(tmp_path / "photos", "my photo.jpg", b"12345")
+    result = trash.trash(item)
+    assert result.error is None
+    assert result.size == 5
+    assert not item.exists()
+    trash_dir = tmp_path / "data" / "Trash"
+    assert result.trashed == trash_dir / "files" / "my photo.jpg"
+    info = trashinfo(trash_dir, "my photo.jpg")
+    # Home trash entries carry the absolute, percent-encoded path
+    assert info["Path"].endswith("/photos/my%20photo.jpg")
+    assert unquote(info["Path"]) == str(item)
+    assert len(info["DeletionDate"]) == len("2024-05-06T07:08:09")
+
+
+def test_trash_name_collisions(trash, tmp_path):
+    first = trash.trash(make_item(tmp_path / "a", "IMG_0001.jpg"))
+    second = trash.trash(make_item(tmp_path / "b", "IMG_0001.jpg"))
+    third = trash.trash(make_item(tmp_path / "c", "IMG_0001.jpg"))
+    names = [r.trashed.name for r in (first, second, third)]
+    assert names == ["IMG_0001.jpg", "IMG_0001.2.jpg", "IMG_0001.3.jpg"]
+    trash_dir = tmp_path / "data" / "Trash"
+    for result, directory in zip((first, second, third), "abc"):
+        info = trashinfo(trash_dir, result.trashed.name)
+        assert unquote(info["Path"]) == str(tmp_path / directory / "IMG_0001.jpg")
+
+
+def test_trash_missing_item_leaves_no_trashinfo(trash, tmp_path):
+    result = trash.trash(tmp_path / "missing.jpg")
+    assert result.error is not None
+    info = tmp_path / "data" / "Trash" / "info"
+    assert not info.exists() or not list(info.iterdir())
+
+
+def test_empty_reports_and_clears(trash, tmp_path):
+    trash.trash_batch([make_item(tmp_path, f"{i}.jpg", b"x" * i) for i in range(4)])
+    reports = []
+    result = trash.empty(reports.append)
+    assert (result.items, result.freed, result.done) == (4, 6, True)
+    assert reports[-1] == result
+    trash_dir = tmp_path / "data" / "Trash"
+    assert not list((trash_dir / "files").iterdir())
+    assert not list((trash_dir / "info").iterdir())
+
+
+def test_mount_points_include_root():
+    points = mount_points()
+    if not Path("/proc/self/mounts").exists():
+        assert points == []
+    else:
+        assert Path("/") in points
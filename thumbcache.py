@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Persistent on-disk thumbnail store.
+
+Uses the freedesktop.org thumbnail layout so thumbnails are shared with file
+managers and other machines that mount the same home directory:
+
+    $XDG_CACHE_HOME/thumbnails/<tier>/<md5 of file URI>.png
+
+with `Thumb::URI`, `Thumb::MTime` and `Thumb::Size` text chunks, which are
+checked against the source before a thumbnail is used. Besides the standard
+`normal` (128), `large` (256), `x-large` (512) and `xx-large` (1024) tiers
+ImgSack adds its own `imgsack-64` tier for small previews.
+
+Writes and re-keys go through a background thread; files are written to a
+temporary name and renamed into place. The thumbnail directories are shared
+with other applications, so only files ImgSack wrote count towards
+`max_bytes`: they are listed with their sizes in `INDEX_FILE`, and the
+store is trimmed back by least recent use among those alone.
+"""
+
+import hashlib
+import json
+import os
+import queue
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from pathlib import Path
+
+from d4mnLogger import logger
+
+THUMBNAIL_TIERS = {
+    64: "imgsack-64",
+    128: "normal",
+    256: "large",
+    512: "x-large",
+    1024: "xx-large",
+}
+THUMBNAIL_CACHE_MAX_BYTES = 512 * 1024 * 1024
+INDEX_FILE = ".imgsack-index.json"
+TRIM_TO = 0.9  # fraction of max_bytes left after a trim
+SOFTWARE = "ImgSack"
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_TEXT_CHUNKS = (b"tEXt", b"zTXt", b"iTXt")
+
+
+def thumbnail_root() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or "~/.cache"
+    return Path(cache_home).expanduser() / "thumbnails"
+
+
+def tier_for(size: int) -> int:
+    for tier in THUMBNAIL_TIERS:
+        if size <= tier:
+            return tier
+    return max(THUMBNAIL_TIERS)
+
+
+def _chunks(png: bytes):
+    pos = len(_PNG_SIGNATURE)
+    while pos + 8 <= len(png):
+        length, kind = struct.unpack_from(">I4s", png, pos)
+        yield kind, png[pos + 8 : pos + 8 + length], png[pos : pos + 12 + length]
+        pos += 12 + length
+
+
+def _chunk(kind: bytes, data: bytes) -> bytes:
+    crc = zlib.crc32(kind + data) & 0xFFFFFFFF
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", crc)
+
+
+def _decode_text(kind: bytes, data: bytes):
+    keyword, _, rest = data.partition(b"\0")
+    if kind == b"tEXt":
+        text = rest
+    elif kind == b"zTXt":
+        text = zlib.decompress(rest[1:])
+    else:
+        compressed, rest = rest[0], rest[2:]
+        _language, _, rest = rest.partition(b"\0")
+        _translated, _, text = rest.partition(b"\0")
+        if compressed:
+            text = zlib.decompress(text)
+    return keyword.decode("latin-1"), text.decode("utf-8", "replace")
+
+
+def png_text(png: bytes) -> dict:
+    """
+    The text chunks of a PNG, stopping at the image data.
+    """
+    text = {}
+    if not png.startswith(_PNG_SIGNATURE):
+        return text
+    for kind, data, _raw in _chunks(png):
+        if kind == b"IDAT":
+            break
+        if kind in _TEXT_CHUNKS:
+            try:
+                key, value = _decode_text(kind, data)
+            except (zlib.error, IndexError):
+                continue
+            text[key] = value
+    return text
+
+
+def set_png_text(png: bytes, text: dict) -> bytes:
+    """
+    Replace (or add) `text` keys as tEXt chunks right after IHDR.
+    """
+    out = [_PNG_SIGNATURE]
+    for kind, data, raw in _chunks(png):
+        if kind in _TEXT_CHUNKS and _decode_text(kind, data)[0] in text:
+            continue
+        out.append(raw)
+        if kind == b"IHDR":
+            for key, value in text.items():
+                out.append(_chunk(b"tEXt", f"{key}\0{value}".encode("latin-1")))
+    return b"".join(out)
+
+
+def thumbnail_text(source_file: Path, stat: os.stat_result) -> dict:
+    return {
+        "Thumb::URI": source_file.absolute().as_uri(),
+        "Thumb::MTime": str(int(stat.st_mtime)),
+        "Thumb::Size": str(stat.st_size),
+        "Software": SOFTWARE,
+    }
+
+
+def encode_thumbnail(image, source_file: Path, stat: os.stat_result) -> bytes:
+    """
+    PNG bytes of a QImage with the freedesktop thumbnail text chunks.
+    """
+    from PySide6.QtCore import QBuffer, QByteArray, QIODevice
+
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QIODevice.WriteOnly)
+    image.save(buffer, "PNG")
+    buffer.close()
+    return set_png_text(bytes(data), thumbnail_text(source_file, stat))
+
+
+class ThumbnailStore:
+    def __init__(self, root: Path = None, max_bytes: int = THUMBNAIL_CACHE_MAX_BYTES):
+        self.root = root if root is not None else thumbnail_root()
+        self.max_bytes = max_bytes
+        # Only touched on the worker thread: relative path -> size
+        self._own = {}
+        self._own_bytes = 0
+        self._index_dirty = False
+        self._queue = queue.Queue()
+        self._queue.put((self._load_index,))
+        self._thread = threading.Thread(
+            target=self._run, name="thumbcache", daemon=True
+        )
+        self._thread.start()
+
+    def path_for(self, source_file: Path, size: int) -> Path:
+        uri = source_file.absolute().as_uri()
+        name = hashlib.md5(uri.encode("utf-8")).hexdigest()
+        return self.root / THUMBNAIL_TIERS[tier_for(size)] / f"{name}.png"
+
+    def has(self, source_file: Path, size: int) -> bool:
+        """
+        Whether a thumbnail at least as new as `source_file` exists. Cheaper
+        than `load`: nothing is read or touched.
+        """
+        try:
+            thumbnail = self.path_for(source_file, size).stat()
+            return thumbnail.st_mtime >= source_file.stat().st_mtime
+        except OSError:
+            return False
+
+    def load(self, source_file: Path, size: int):
+        """
+        Cached PNG bytes for `source_file`, or None if missing or stale.
+        """
+        thumbnail = self.path_for(source_file, size)
+        try:
+            data = thumbnail.read_bytes()
+            stat = source_file.stat()
+        except OSError:
+            return None
+        text = png_text(data)
+        if (
+            text.get("Thumb::MTime") != str(int(stat.st_mtime))
+            or text.get("Thumb::Size", str(stat.st_size)) != str(stat.st_size)
+        ):
+            return None
+        try:
+            # Touch for LRU trimming
+            os.utime(thumbnail)
+        except OSError:
+            pass
+        return data
+
+    def load_image(self, source_file: Path, size: int):
+        from PySide6.QtGui import QImage
+
+        data = self.load(source_file, size)
+        if data is None:
+            return None
+        image = QImage.fromData(data, "PNG")
+        return None if image.isNull() else image
+
+    def store(self, source_file: Path, size: int, data: bytes) -> None:
+        self._queue.put((self._write, self.path_for(source_file, size), data))
+
+    def rekey(self, old_file: Path, new_file: Path) -> None:
+        """
+        Move the thumbnails of `old_file` to `new_file` after a rename.
+        """
+        self._queue.put((self._rekey, old_file, new_file))
+
+    def flush(self) -> None:
+        """
+        Wait for queued writes and re-keys, and save the index.
+        """
+        self._queue.put((self._save_index,))
+        self._queue.join()
+
+    def _run(self) -> None:
+        while True:
+            job, *args = self._queue.get()
+            try:
+                job(*args)
+            except (OSError, ValueError, zlib.error) as e:
+                logger.warning(f"Thumbnail cache: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _write(self, thumbnail: Path, data: bytes, own: bool = True) -> None:
+        thumbnail.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        fd, temp = tempfile.mkstemp(
+            prefix=f".{thumbnail.stem}.", suffix=".tmp", dir=thumbnail.parent
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            # mkstemp already created the file 0600, as the spec asks
+            os.replace(temp, thumbnail)
+        except OSError:
+            try:
+                os.unlink(temp)
+            except FileNotFoundError:
+                pass
+            raise
+        if not own:
+            self._drop_own(self._relative(thumbnail))
+            return
+        self._add_own(thumbnail, len(data))
+        if self._own_bytes > self.max_bytes:
+            self.trim()
+
+    def _relative(self, thumbnail: Path) -> str:
+        return str(thumbnail.relative_to(self.root))
+
+    def _add_own(self, thumbnail: Path, size: int) -> None:
+        relative = self._relative(thumbnail)
+        self._own_bytes += size - self._own.get(relative, 0)
+        self._own[relative] = size
+        self._index_dirty = True
+
+    def _drop_own(self, relative: str) -> None:
+        self._own_bytes -= self._own.pop(relative, 0)
+        self._index_dirty = True
+
+    def _load_index(self) -> None:
+        try:
+            self._own = json.loads((self.root / INDEX_FILE).read_text())
+        except FileNotFoundError:
+            # First run: only our own tier is known to be ours
+            own_tier = self.root / THUMBNAIL_TIERS[min(THUMBNAIL_TIERS)]
+            if own_tier.is_dir():
+                with os.scandir(own_tier) as it:
+                    for entry in it:
+                        if entry.name.endswith(".png"):
+                            self._add_own(Path(entry.path), entry.stat().st_size)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring thumbnail index: {e}")
+        self._own_bytes = sum(self._own.values())
+
+    def _save_index(self) -> None:
+        if not self._index_dirty:
+            return
+        self.root.mkdir(mode=0o700, parents=True, exist_ok=True)
+        fd, temp = tempfile.mkstemp(prefix=f"{INDEX_FILE}.", dir=self.root)
+        with os.fdopen(fd, "w") as f:
+            json.dump(self._own, f)
+        os.replace(temp, self.root / INDEX_FILE)
+        self._index_dirty = False
+
+    def _rekey(self, old_file: Path, new_file: Path) -> None:
+        new_uri = new_file.absolute().as_uri()
+        for tier in THUMBNAIL_TIERS:
+            old = self.path_for(old_file, tier)
+            try:
+                data = old.read_bytes()
+            except FileNotFoundError:
+                continue
+            # Only the URI chunk changes; the image data is copied as is
+            data = set_png_text(data, {"Thumb::URI": new_uri})
+            # Another application's thumbnail stays theirs under its new name
+            relative = self._relative(old)
+            self._write(self.path_for(new_file, tier), data, relative in self._own)
+            old.unlink()
+            self._drop_own(relative)
+
+    def trim(self) -> None:
+        """
+        Remove ImgSack's least recently used thumbnails until they take up
+        `TRIM_TO` of `max_bytes`. Other applications' files are never counted
+        or touched.
+        """
+        started = time.monotonic()
+        entries = []
+        for relative in list(self._own):
+            try:
+                st = (self.root / relative).stat()
+            except OSError:
+                # Removed by someone else
+                self._drop_own(relative)
+                continue
+            entries.append((st.st_mtime, relative))
+        removed = 0
+        entries.sort()
+        for _mtime, relative in entries:
+            if self._own_bytes <= self.max_bytes * TRIM_TO:
+                break
+            try:
+                os.unlink(self.root / relative)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue
+            self._drop_own(relative)
+            removed += 1
+        self._save_index()
+        logger.info(
+            f"Trimmed {removed} thumbnails in {time.monotonic() - started:.2f}s"
+        )
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Optional transcode/recompress stage for items moved into an album.
+
+Albums opt in through `imgsack.json`:
+
+    {"directory": "Screenshots/", "transcode": {"format": "webp", "quality": 80}}
+
+`format` may be `webp`, `avif`, `jpeg`, `png` or `keep` (re-encode in the
+original format). Qt's encoders never carry metadata over, so every
+transcode strips it; `"format": "keep", "strip_metadata": true` does only
+that. Jobs run in a process pool; the original is only removed once the new
+file has been written, synced and read back successfully. Animated or
+multi-frame images, and images with alpha going to a format without it,
+are left as they are.
+"""
+
+import multiprocessing
+import os
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import profiler
+from d4mnLogger import logger
+from imscore import unique_path
+from profiler import span
+
+TRANSCODE_FORMATS = {
+    "jpeg": ".jpg",
+    "jpg": ".jpg",
+    "webp": ".webp",
+    "avif": ".avif",
+    "png": ".png",
+    "keep": None,
+}
+NO_ALPHA_FORMATS = {b"jpeg"}
+DEFAULT_QUALITY = 85
+TEMP_PREFIX = ".imgsack-transcode-"
+TRANSCODE_BACKLOG = 256  # items waiting for a pool slot before new ones are dropped
+
+TranscodeSettings = namedtuple(
+    "TranscodeSettings", ["format", "quality", "strip_metadata"]
+)
+# dir_mtime: the album directory's st_mtime_ns from before the transcode
+TranscodeResult = namedtuple(
+    "TranscodeResult",
+    ["source", "output", "bytes_in", "bytes_out", "error", "dir_mtime"],
+    defaults=(None,),
+)
+
+
+def settings_from_config(config: dict) -> TranscodeSettings:
+    fmt = config.get("format", "keep").lower()
+    if fmt not in TRANSCODE_FORMATS:
+        raise ValueError(f"Unknown transcode format {fmt}")
+    quality = int(config.get("quality", DEFAULT_QUALITY))
+    return TranscodeSettings(fmt, quality, bool(config.get("strip_metadata", True)))
+
+
+def transcode_file(source: str, settings: TranscodeSettings) -> TranscodeResult:
+    """
+    Re-encode `source` in place according to `settings`. Runs in a worker process.
+    """
+    from PySide6.QtCore import QFile, QIODevice
+    from PySide6.QtGui import QImageReader, QImageWriter
+
+    source = Path(source)
+    bytes_in = source.stat().st_size
+    # Before the temporary file below changes the directory
+    dir_mtime = source.parent.stat().st_mtime_ns
+    suffix = TRANSCODE_FORMATS[settings.format] or source.suffix.lower()
+    writer_format = suffix.lstrip(".").replace("jpg", "jpeg").encode("ascii")
+    temp = source.with_name(f"{TEMP_PREFIX}{os.getpid()}-{source.stem}{suffix}")
+    try:
+        # Decode from an open device so the reader streams the file instead
+        # of slurping it into a QByteArray first
+        device = QFile(str(source))
+        if not device.open(QIODevice.ReadOnly):
+            raise OSError(f"Cannot open {source}: {device.errorString()}")
+        reader = QImageReader(device)
+        reader.setAutoTransform(True)
+        # Only the first frame would survive, and the original gets deleted
+        if reader.supportsAnimation() or reader.imageCount() > 1:
+            raise ValueError("animated or multi-frame image, left as is")
+        with span("decode", item=source.name):
+            image = reader.read()
+        device.close()
+        if image.isNull():
+            raise ValueError(f"Cannot decode {source}: {reader.errorString()}")
+        if image.hasAlphaChannel() and writer_format in NO_ALPHA_FORMATS:
+            raise ValueError(f"{suffix} cannot keep transparency, left as is")
+
+        writer = QImageWriter(str(temp), writer_format)
+        writer.setQuality(settings.quality)
+        writer.setOptimizedWrite(True)
+        with span("encode", format=writer_format.decode("ascii")):
+            written = writer.write(image)
+        if not written:
+            raise ValueError(f"Cannot encode {temp}: {writer.errorString()}")
+        writer.device().close()
+
+        fd = os.open(temp, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        check = QImageReader(str(temp))
+        if check.size() != image.size() or check.read().isNull():
+            raise ValueError(f"Verification of {temp} failed: {check.errorString()}")
+
+        output = source.with_suffix(suffix)
+        if output != source:
+            output = unique_path(output)
+        os.replace(temp, output)
+        if output != source:
+            source.unlink()
+        bytes_out = output.stat().st_size
+        return TranscodeResult(source, output, bytes_in, bytes_out, None, dir_mtime)
+    except (OSError, ValueError) as e:
+        try:
+            temp.unlink()
+        except FileNotFoundError:
+            pass
+        return TranscodeResult(source, None, bytes_in, 0, str(e))
+
+
+class TranscodePipeline:
+    """
+    Feeds transcode jobs to a process pool with bounded in-flight work.
+
+    `submit` never blocks the caller: items wait in a local backlog and a
+    feeder thread only hands a job to the pool when one of its
+    `2 * workers` slots frees up, so the pool's own queue never grows
+    with operator speed. Once `TRANSCODE_BACKLOG` items are waiting, new
+    items are kept as they are and reported as failed. `on_done` is
+    called with a `TranscodeResult`, normally from a pool callback thread.
+    """
+
+    def __init__(self, album_settings: dict, workers: int = None, on_done=None):
+        self.album_settings = {
+            Path(folder).resolve(): settings
+            for folder, settings in album_settings.items()
+        }
+        self.on_done = on_done
+        workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        initializer, initargs = profiler.worker_initializer()
+        self._pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=initializer,
+            initargs=initargs,
+        )
+        self._slots = threading.BoundedSemaphore(workers * 2)
+        self._backlog = deque()
+        self._in_flight = 0
+        self._wake = threading.Condition()
+        self._stopping = False
+        self._feeder = threading.Thread(
+            target=self._feed, name="transcode", daemon=True
+        )
+        self._feeder.start()
+
+    def settings_for(self, destination_folder: Path):
+        return self.album_settings.get(Path(destination_folder).resolve())
+
+    def submit(self, item: Path) -> bool:
+        settings = self.settings_for(item.parent)
+        if settings is None or item.name.startswith(TEMP_PREFIX):
+            return False
+        if TRANSCODE_FORMATS[settings.format] is None and not settings.strip_metadata:
+            return False
+        with self._wake:
+            full = len(self._backlog) >= TRANSCODE_BACKLOG
+            if not full:
+                self._backlog.append((str(item), settings))
+                self._wake.notify()
+        if full:
+            logger.warning(f"Transcode backlog full, {item} left as is")
+            if self.on_done is not None:
+                size = item.stat().st_size
+                error = "transcode backlog full, left as is"
+                self.on_done(TranscodeResult(item, None, size, 0, error))
+            return False
+        return True
+
+    def pending(self) -> int:
+        """
+        Items waiting or being transcoded.
+        """
+        with self._wake:
+            return len(self._backlog) + self._in_flight
+
+    def _feed(self) -> None:
+        while True:
+            with self._wake:
+                while not self._backlog and not self._stopping:
+                    self._wake.wait()
+                if not self._backlog:
+                    return
+                job = self._backlog.popleft()
+                self._in_flight += 1
+            self._slots.acquire()
+            try:
+                future = self._pool.submit(transcode_file, *job)
+            except RuntimeError:
+                # Cancelled by shutdown() while waiting for a slot
+                return
+            future.add_done_callback(self._finished)
+
+    def _finished(self, future) -> None:
+        with self._wake:
+            self._in_flight -= 1
+        self._slots.release()
+        if future.cancelled():
+            return
+        try:
+            result = future.result()
+        except Exception as e:
+            logger.error(f"Transcode worker failed: {e}")
+            return
+        if result.error is not None:
+            logger.error(f"Transcode of {result.source} failed: {result.error}")
+        else:
+            logger.info(
+                f"Transcoded {result.source} to {result.output.name}: "
+                f"{result.bytes_in} -> {result.bytes_out} bytes"
+            )
+        if self.on_done is not None:
+            self.on_done(result)
+
+    def shutdown(self, cancel: bool = False) -> None:
+        """
+        Wait for every submitted item, or with `cancel` drop the ones that
+        have not started. Originals of dropped items are untouched.
+        """
+        with self._wake:
+            self._stopping = True
+            if cancel:
+                self._backlog.clear()
+            self._wake.notify()
+        if not cancel:
+            self._feeder.join()
+        self._pool.shutdown(wait=not cancel, cancel_futures=cancel)
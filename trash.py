@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+freedesktop.org Trash support.
+
+Items are moved (renamed) into a trash directory on the same device as the
+item, so trashing never copies data. Each item gets a `.trashinfo` file as
+described in https://specifications.freedesktop.org/trash-spec/ . Work is
+done on a worker thread in batches, with one fsync per touched directory per
+batch instead of one per item.
+"""
+
+import os
+import queue
+import re
+import shutil
+import stat
+import threading
+from collections import namedtuple
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import quote
+
+from d4mnLogger import logger
+
+TRASH_BATCH_SIZE = 64
+TRASH_BATCH_WAIT = 0.05  # seconds to wait for more items before flushing a batch
+EMPTY_REPORT_EVERY = 256
+
+TrashResult = namedtuple("TrashResult", ["source", "trashed", "size", "error"])
+EmptyProgress = namedtuple("EmptyProgress", ["items", "freed", "done"])
+
+
+def home_trash() -> Path:
+    data_home = os.environ.get("XDG_DATA_HOME") or "~/.local/share"
+    return Path(data_home).expanduser() / "Trash"
+
+
+def mount_point(p: Path) -> Path:
+    p = p.resolve()
+    device = p.stat().st_dev
+    while p.parent != p and p.parent.stat().st_dev == device:
+        p = p.parent
+    return p
+
+
+def mount_points() -> list:
+    """
+    Mount points listed in /proc/self/mounts (empty where there is none).
+    """
+    try:
+        lines = Path("/proc/self/mounts").read_text().splitlines()
+    except OSError:
+        return []
+    points = []
+    for line in lines:
+        fields = line.split()
+        if len(fields) > 1:
+            # Blanks in the path are escaped as octal, e.g. \040
+            point = re.sub(r"\\([0-7]{3})", lambda m: chr(int(m[1], 8)), fields[1])
+            points.append(Path(point))
+    return points
+
+
+def tree_size(p: Path) -> int:
+    st = p.lstat()
+    if not stat.S_ISDIR(st.st_mode):
+        return st.st_size
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(p):
+        for name in filenames + dirnames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _fsync_directory(directory: Path) -> None:
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Trash:
+    """
+    Chooses the trash directory for an item and moves it there.
+
+    Trash directories are looked up once per device and remembered.
+    """
+
+    def __init__(self):
+        self._uid = os.getuid()
+        self._home = home_trash()
+        self._home.mkdir(parents=True, exist_ok=True)
+        self._home_device = self._home.stat().st_dev
+        self._by_device = {self._home_device: self._home}
+        self._lock = threading.Lock()
+
+    def directories(self) -> list:
+        """
+        The home trash, the trashes used this session and every trash of
+        ours at the top of a mounted filesystem.
+        """
+        with self._lock:
+            found = list(self._by_device.values())
+        for topdir in mount_points():
+            for trash_dir in self._own_trashes(topdir):
+                if trash_dir not in found:
+                    found.append(trash_dir)
+        return found
+
+    def _own_trashes(self, topdir: Path) -> list:
+        candidates = [topdir / f".Trash-{self._uid}"]
+        try:
+            st = (topdir / ".Trash").lstat()
+            if stat.S_ISDIR(st.st_mode) and st.st_mode & stat.S_ISVTX:
+                candidates.append(topdir / ".Trash" / str(self._uid))
+        except OSError:
+            pass
+        own = []
+        for trash_dir in candidates:
+            try:
+                st = trash_dir.lstat()
+            except OSError:
+                continue
+            # Never follow a symlink or empty someone else's trash
+            if stat.S_ISDIR(st.st_mode) and st.st_uid == self._uid:
+                own.append(trash_dir)
+        return own
+
+    def trash_directory(self, item: Path) -> Path:
+        device = item.lstat().st_dev
+        with self._lock:
+            if device not in self._by_device:
+                self._by_device[device] = self._topdir_trash(mount_point(item.parent))
+            trash_dir = self._by_device[device]
+        (trash_dir / "files").mkdir(mode=0o700, parents=True, exist_ok=True)
+        (trash_dir / "info").mkdir(mode=0o700, parents=True, exist_ok=True)
+        return trash_dir
+
+    def _topdir_trash(self, topdir: Path) -> Path:
+        shared = topdir / ".Trash"
+        try:
+            st = shared.lstat()
+            if stat.S_ISDIR(st.st_mode) and st.st_mode & stat.S_ISVTX:
+                return shared / str(self._uid)
+            logger.warning(f"{shared} is not a sticky directory - ignoring it")
+        except FileNotFoundError:
+            pass
+        return topdir / f".Trash-{self._uid}"
+
+    def _info_path(self, item: Path, trash_dir: Path) -> str:
+        # The spec wants paths relative to the top directory for per-device
+        # trashes and absolute paths for the home trash.
+        if trash_dir == self._home:
+            return str(item)
+        return os.path.relpath(item, mount_point(item.parent))
+
+    def trash(self, item: Path) -> TrashResult:
+        try:
+            item = item.absolute()
+            size = tree_size(item)
+            trash_dir = self.trash_directory(item)
+            info = (
+                "[Trash Info]\n"
+                f"Path={quote(self._info_path(item, trash_dir))}\n"
+                f"DeletionDate={datetime.now().strftime('%Y-%m-%dT%H:%M:%S')}\n"
+            ).encode("utf-8")
+            name = item.name
+            counter = 1
+            while True:
+                info_file = trash_dir / "info" / f"{name}.trashinfo"
+                try:
+                    fd = os.open(info_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                    break
+                except FileExistsError:
+                    counter += 1
+                    name = f"{item.stem}.{counter}{item.suffix}"
+            try:
+                os.write(fd, info)
+            finally:
+                os.close(fd)
+            destination = trash_dir / "files" / name
+            try:
+                item.rename(destination)
+            except OSError:
+                info_file.unlink()
+                raise
+        except OSError as e:
+            logger.error(f"Could not trash {item}: {e}")
+            return TrashResult(item, None, 0, e)
+        logger.info(f"Trashed {item} to {destination}")
+        return TrashResult(item, destination, size, None)
+
+    def trash_batch(self, items: list) -> list:
+        results = [self.trash(item) for item in items]
+        touched = {r.trashed.parent.parent for r in results if r.trashed is not None}
+        for trash_dir in touched:
+            for sub in ("info", "files"):
+                try:
+                    _fsync_directory(trash_dir / sub)
+                except OSError as e:
+                    logger.warning(f"fsync of {trash_dir / sub} failed: {e}")
+        return results
+
+    def size(self) -> int:
+        total = 0
+        for trash_dir in self.directories():
+            files = trash_dir / "files"
+            if not files.is_dir():
+                continue
+            with os.scandir(files) as entries:
+                for entry in entries:
+                    try:
+                        total += tree_size(Path(entry.path))
+                    except OSError:
+                        pass
+        return total
+
+    def empty(self, progress=None, cancel: threading.Event = None) -> EmptyProgress:
+        """
+        Permanently delete everything in all our trash directories.
+
+        Entries are streamed with `os.scandir`, so very large trash
+        directories are never listed into memory. `progress` is called with
+        an `EmptyProgress` every `EMPTY_REPORT_EVERY` items and at the end.
+        Setting `cancel` stops after the current entry.
+        """
+        items = 0
+        freed = 0
+        for trash_dir in self.directories():
+            files = trash_dir / "files"
+            if not files.is_dir():
+                continue
+            with os.scandir(files) as entries:
+                for entry in entries:
+                    if cancel is not None and cancel.is_set():
+                        break
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            size = tree_size(Path(entry.path))
+                            shutil.rmtree(entry.path)
+                        else:
+                            size = entry.stat(follow_symlinks=False).st_size
+                            os.unlink(entry.path)
+                    except OSError as e:
+                        logger.error(f"Could not delete {entry.path}: {e}")
+                        continue
+                    try:
+                        os.unlink(trash_dir / "info" / f"{entry.name}.trashinfo")
+                    except FileNotFoundError:
+                        pass
+                    items += 1
+                    freed += size
+                    if progress is not None and items % EMPTY_REPORT_EVERY == 0:
+                        progress(EmptyProgress(items, freed, False))
+        if cancel is not None and cancel.is_set():
+            logger.info(f"Emptying trash cancelled after {items} items")
+        else:
+            logger.info(f"Emptied trash: {items} items, {freed} bytes")
+        result = EmptyProgress(items, freed, True)
+        if progress is not None:
+            progress(result)
+        return result
+
+
+class TrashWorker:
+    """
+    Background thread that trashes queued items in batches.
+
+    `on_batch` is called from the worker thread with the list of
+    `TrashResult`s for each batch; `on_empty` with `EmptyProgress` updates.
+    """
+
+    _EMPTY = object()
+    _STOP = object()
+
+    def __init__(self, trash: Trash = None, on_batch=None, on_empty=None):
+        self.trash = trash if trash is not None else Trash()
+        self.on_batch = on_batch
+        self.on_empty = on_empty
+        self._queue = queue.Queue()
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="trash", daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Path) -> None:
+        self._queue.put(item)
+
+    def empty(self) -> None:
+        self._queue.put(self._EMPTY)
+
+    def stop(self) -> None:
+        """
+        Finish the queued items and return. An empty that is still running
+        is cancelled; whatever it did not get to stays in the trash.
+        """
+        self._cancel.set()
+        self._queue.put(self._STOP)
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            batch = []
+            while job is not self._STOP and job is not self._EMPTY:
+                batch.append(job)
+                if len(batch) >= TRASH_BATCH_SIZE:
+                    break
+                try:
+                    job = self._queue.get(timeout=TRASH_BATCH_WAIT)
+                except queue.Empty:
+                    job = None
+                    break
+            if batch:
+                results = self.trash.trash_batch(batch)
+                if self.on_batch is not None:
+                    self.on_batch(results)
+            if job is self._EMPTY:
+                self.trash.empty(self.on_empty, self._cancel)
+            elif job is self._STOP:
+                return
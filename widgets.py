@@ -3,9 +3,29 @@
 import sys
 from pathlib import Path
 
+from PySide6.QtCore import (
+    QObject,
+    QPointF,
+    QRect,
+    QRunnable,
+    QSize,
+    QThreadPool,
+    QTimer,
+    Qt,
+    Signal,
+)
+from PySide6.QtGui import QPixmap
 from PySide6.QtWidgets import *
 
 from d4mnLogger import logger
+from pyramid import ImagePyramid, PyramidCache
+from thumbcache import ThumbnailStore, encode_thumbnail
+
+SMOOTH_SCALE_DELAY = 150  # ms after the last resize/zoom before the smooth pass
+MIN_ZOOM = 0.125
+MAX_ZOOM = 8.0
+ZOOM_STEP = 1.25
+PREVIEW_SIZE = 512
 
 
 class AboutBox(QMessageBox):
@@ -54,6 +74,259 @@ class Image(QLabel):
             self._max_height = kwargs["max_height"]
 
 
+class _Job(QRunnable):
+    def __init__(self, func):
+        super().__init__()
+        self._func = func
+
+    def run(self):
+        self._func()
+
+
+class _ImageViewSignals(QObject):
+    loaded = Signal(object, object)
+    preview = Signal(object, object)
+    scaled = Signal(object, object, object)
+
+
+class ImageView(QLabel):
+    """
+    Label that shows an image from a `PyramidCache`.
+
+    Decoding and the final smooth scale run on the global thread pool. While
+    the label is being resized, zoomed (wheel) or panned (drag) it shows a
+    fast scale of just the visible part of the nearest pyramid level, and
+    the smooth pass follows once things settle. The item on screen is
+    pinned in the cache. `set_badge` overlays a short note, e.g. the size
+    of a burst.
+    With a `ThumbnailStore`, a cached preview is shown while the full image
+    decodes, and decoded images leave a preview behind for next time.
+    `previews` can instead be a (possibly slow) `previews(path, size)`
+    callable returning a QImage or None; it is called on the thread pool.
+    """
+
+    def __init__(
+        self,
+        cache: PyramidCache = None,
+        thumbnails: ThumbnailStore = None,
+        previews=None,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.cache = cache if cache is not None else PyramidCache()
+        self.thumbnails = thumbnails
+        self.previews = previews
+        self.zoom = 1.0
+        self._center = None  # of the view, in full-size image pixels
+        self._drag = None
+        self._path = None
+        self._loading = set()
+        self._signals = _ImageViewSignals()
+        self._signals.loaded.connect(self._loaded)
+        self._signals.preview.connect(self._preview)
+        self._signals.scaled.connect(self._scaled)
+        self._smooth_timer = QTimer(self)
+        self._smooth_timer.setSingleShot(True)
+        self._smooth_timer.setInterval(SMOOTH_SCALE_DELAY)
+        self._smooth_timer.timeout.connect(self._smooth_scale)
+        # Never let the pixmap push the layout around
+        self.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Ignored)
+        self._badge = QLabel(self)
+        self._badge.setStyleSheet(
+            "background: rgba(0, 0, 0, 160); color: white;"
+            " border-radius: 4px; padding: 4px 8px; font-weight: bold;"
+        )
+        self._badge.hide()
+
+    def set_badge(self, text: str) -> None:
+        self._badge.setText(text)
+        self._badge.adjustSize()
+        self._badge.setVisible(bool(text))
+        self._place_badge()
+
+    def _place_badge(self) -> None:
+        self._badge.move(self.width() - self._badge.width() - 8, 8)
+
+    def set_item(self, path: Path) -> None:
+        if path != self._path:
+            self.zoom = 1.0
+            self._center = None
+        self._path = path
+        self.cache.pin(path)
+        if path is None:
+            self.clear()
+            return
+        if self.cache.get(path) is not None:
+            self._render()
+            return
+        self.setText(f"{path.name}")
+        if self.thumbnails is not None:
+            self._preview(path, self.thumbnails.load_image(path, PREVIEW_SIZE))
+        elif self.previews is not None:
+            QThreadPool.globalInstance().start(
+                _Job(
+                    lambda: self._signals.preview.emit(
+                        path, self.previews(path, PREVIEW_SIZE)
+                    )
+                )
+            )
+        self.prefetch(path)
+
+    def _preview(self, path: Path, preview) -> None:
+        # Only until the full image is there
+        if preview is None or path != self._path or path in self.cache:
+            return
+        self.setPixmap(
+            QPixmap.fromImage(preview).scaled(
+                self.size(), Qt.KeepAspectRatio, Qt.FastTransformation
+            )
+        )
+
+    def prefetch(self, path: Path) -> None:
+        if path in self._loading or self.cache.get(path) is not None:
+            return
+        self._loading.add(path)
+        QThreadPool.globalInstance().start(_Job(lambda: self._load(path)))
+
+    def _load(self, path: Path) -> None:
+        # Runs on the thread pool
+        pyramid = ImagePyramid.load(path)
+        self._signals.loaded.emit(path, pyramid)
+        if (
+            pyramid is not None
+            and self.thumbnails is not None
+            and not self.thumbnails.has(path, PREVIEW_SIZE)
+        ):
+            try:
+                preview = pyramid.scaled(QSize(PREVIEW_SIZE, PREVIEW_SIZE), smooth=True)
+                data = encode_thumbnail(preview, path, path.stat())
+            except OSError:
+                return
+            self.thumbnails.store(path, PREVIEW_SIZE, data)
+
+    def _loaded(self, path: Path, pyramid) -> None:
+        self._loading.discard(path)
+        if pyramid is not None:
+            self.cache.put(path, pyramid)
+        if path == self._path:
+            if pyramid is None:
+                self.setText(f"Cannot display {path.name}")
+            else:
+                self._render()
+
+    def _pyramid(self):
+        if self._path is None:
+            return None
+        pyramid = self.cache.get(self._path)
+        if pyramid is None:
+            # Not decoded yet, or dropped before it was pinned
+            self.prefetch(self._path)
+        return pyramid
+
+    def _scale(self, pyramid) -> float:
+        # Screen pixels per full-size image pixel
+        size = pyramid.size()
+        fit = min(self.width() / size.width(), self.height() / size.height())
+        return fit * self.zoom
+
+    def _view(self, pyramid) -> tuple:
+        """
+        The visible rectangle in full-size pixels and its size on screen.
+        """
+        size = pyramid.size()
+        scale = self._scale(pyramid)
+        width = min(size.width(), self.width() / scale)
+        height = min(size.height(), self.height() / scale)
+        x, y = self._center or (size.width() / 2, size.height() / 2)
+        x = min(max(x, width / 2), size.width() - width / 2)
+        y = min(max(y, height / 2), size.height() - height / 2)
+        self._center = (x, y)
+        rect = QRect(
+            int(x - width / 2),
+            int(y - height / 2),
+            max(1, int(width)),
+            max(1, int(height)),
+        )
+        target = QSize(max(1, round(width * scale)), max(1, round(height * scale)))
+        return rect, target
+
+    def _render(self) -> None:
+        pyramid = self._pyramid()
+        if pyramid is None:
+            return
+        self.setPixmap(QPixmap.fromImage(pyramid.region(*self._view(pyramid))))
+        self._smooth_timer.start()
+
+    def _smooth_scale(self) -> None:
+        pyramid = self._pyramid()
+        if pyramid is None:
+            return
+        path, view = self._path, self._view(pyramid)
+        QThreadPool.globalInstance().start(
+            _Job(
+                lambda: self._signals.scaled.emit(
+                    path, view, pyramid.region(*view, smooth=True)
+                )
+            )
+        )
+
+    def _scaled(self, path: Path, view: tuple, image) -> None:
+        # Drop results for an item or view that is no longer showing
+        pyramid = self.cache.get(path) if path == self._path else None
+        if pyramid is not None and view == self._view(pyramid):
+            self.setPixmap(QPixmap.fromImage(image))
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self._place_badge()
+        self._render()
+
+    def wheelEvent(self, event):
+        steps = event.angleDelta().y() / 120
+        pyramid = self._pyramid()
+        if steps == 0 or pyramid is None:
+            return super().wheelEvent(event)
+        # Keep the image point under the cursor where it is
+        offset = event.position() - QPointF(self.width() / 2, self.height() / 2)
+        self._view(pyramid)
+        x, y = self._center
+        scale = self._scale(pyramid)
+        point = (x + offset.x() / scale, y + offset.y() / scale)
+        self.zoom = min(MAX_ZOOM, max(MIN_ZOOM, self.zoom * ZOOM_STEP**steps))
+        scale = self._scale(pyramid)
+        self._center = (point[0] - offset.x() / scale, point[1] - offset.y() / scale)
+        self._render()
+        event.accept()
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton and self._center is not None:
+            self._drag = (event.position(), self._center)
+            self.setCursor(Qt.ClosedHandCursor)
+            event.accept()
+        else:
+            super().mousePressEvent(event)
+
+    def mouseMoveEvent(self, event):
+        pyramid = self._pyramid() if self._drag is not None else None
+        if pyramid is None:
+            return super().mouseMoveEvent(event)
+        start, (x, y) = self._drag
+        moved = event.position() - start
+        scale = self._scale(pyramid)
+        self._center = (x - moved.x() / scale, y - moved.y() / scale)
+        self._render()
+        event.accept()
+
+    def mouseReleaseEvent(self, event):
+        if self._drag is not None and event.button() == Qt.LeftButton:
+            self._drag = None
+            self.unsetCursor()
+            event.accept()
+        else:
+            super().mouseReleaseEvent(event)
+
+
 class StatusBar(QStatusBar):
     _areas = dict()
 
@@ -83,7 +356,6 @@ class StatusBar(QStatusBar):
 
 
 if __name__ == "__main__":
-    from PySide6.QtCore import QSize
     from PySide6.QtWidgets import QApplication, QMainWindow
 
     app = QApplication([])